@@ -6,20 +6,47 @@ import os
 from datetime import datetime
 import threading
 import queue
+import time
 import sys
 import difflib
 import webbrowser
+import gc
+import copy
+import inspect
+import hashlib
+import re
+import sqlite3
+import argparse
+import cProfile
+import ctypes
+import urllib.request
+import urllib.error
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager, nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 warnings.filterwarnings("ignore")
 
 try:
-    from transformers import OpenAIGPTTokenizer, OpenAIGPTLMHeadModel, AutoTokenizer, AutoModelForCausalLM
+    from transformers import OpenAIGPTTokenizer, OpenAIGPTLMHeadModel, AutoTokenizer, AutoModelForCausalLM, GenerationConfig
+    from transformers import StoppingCriteria, StoppingCriteriaList, TextStreamer
     import torch
     TRANSFORMERS_AVAILABLE = True
+    PROMPT_LOOKUP_AVAILABLE = hasattr(GenerationConfig(), 'prompt_lookup_num_tokens')
+    try:
+        from transformers import DynamicCache
+    except ImportError:
+        DynamicCache = None
 except ImportError as e:
     print(f"Ошибка импорта transformers: {e}")
     print("Установите библиотеки: pip install transformers torch")
     TRANSFORMERS_AVAILABLE = False
+    PROMPT_LOOKUP_AVAILABLE = False
+    DynamicCache = None
+    StoppingCriteria = object
+    StoppingCriteriaList = list
+    TextStreamer = object
     
     class Stub:
         def __init__(self, *args, **kwargs):
@@ -41,24 +68,35 @@ except ImportError as e:
     AutoModelForCausalLM = Stub
     torch = type('torch', (), {'device': lambda x: 'cpu', 'cuda': type('cuda', (), {'is_available': lambda: False})()})()
 
+try:
+    import psutil
+    PSUTIL_AVAILABLE = True
+except ImportError:
+    PSUTIL_AVAILABLE = False
+
 try:
     from googletrans import Translator
-    TRANSLATOR_AVAILABLE = True
-    translator = Translator()
+    GOOGLETRANS_AVAILABLE = True
 except ImportError:
     print("Библиотека googletrans не установлена. Установите: pip install googletrans==4.0.0-rc1")
-    TRANSLATOR_AVAILABLE = False
-    translator = None
+    GOOGLETRANS_AVAILABLE = False
+
+TRANSLATOR_AVAILABLE = False
+translator = None
 
 class KnowledgeBase:
     def __init__(self, education_dir):
         self.education_dir = education_dir
+        self.translations_file = os.path.join(education_dir, "translations.json")
+        self.translations = {}
         self.data = []
+        self.version_hash = None
         self.load_data()
     
     def load_data(self):
         """Загружает данные из ВСЕХ TXT файлов в папке education/"""
         self.data = []
+        self.version_hash = None
         
         if not os.path.exists(self.education_dir):
             print(f"Папка {self.education_dir} не найдена. Создаю...")
@@ -80,6 +118,7 @@ class KnowledgeBase:
             print(f"Загружено {loaded} записей из {txt_file}")
         
         print(f"Всего загружено {total_loaded} записей из {len(txt_files)} файлов")
+        self.apply_saved_translations()
     
     def load_txt_file(self, filepath):
         """Загружает данные из TXT файла ЛЮБОГО формата"""
@@ -122,8 +161,43 @@ class KnowledgeBase:
             print(f"Ошибка загрузки файла {filepath}: {e}")
             return 0
     
+    def apply_saved_translations(self):
+        """Подставляет сохранённые переводы в записи свободного текста"""
+        try:
+            if os.path.exists(self.translations_file):
+                with open(self.translations_file, 'r', encoding='utf-8') as f:
+                    self.translations = json.load(f)
+        except Exception as e:
+            print(f"Ошибка загрузки переводов базы знаний: {e}")
+            self.translations = {}
+        
+        for item in self.data:
+            if not item['english'] and item['russian'] in self.translations:
+                item['english'] = self.translations[item['russian']]
+    
+    def missing_translations(self):
+        """Тексты записей, у которых ещё нет английского перевода"""
+        return list(dict.fromkeys(item['russian'] for item in self.data if not item['english']))
+    
+    def set_translations(self, translations):
+        """Заполняет поле english и сохраняет переводы рядом с TXT файлами"""
+        self.translations.update(translations)
+        for item in self.data:
+            if not item['english'] and item['russian'] in translations:
+                item['english'] = translations[item['russian']]
+        self.version_hash = None
+        
+        try:
+            temp_path = self.translations_file + ".tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.translations, f, ensure_ascii=False, indent=2)
+            os.replace(temp_path, self.translations_file)
+        except Exception as e:
+            print(f"Ошибка сохранения переводов базы знаний: {e}")
+    
     def add_data(self, russian, english, context="", source_file=""):
         """Добавляет новую запись в базу знаний"""
+        self.version_hash = None
         self.data.append({
             'russian': russian,
             'english': english,
@@ -145,18 +219,27 @@ class KnowledgeBase:
         except Exception as e:
             print(f"Ошибка сохранения {filename}: {e}")
     
+    def get_version(self):
+        """Хэш содержимого базы знаний, меняется при любом изменении записей"""
+        if self.version_hash is None:
+            content = json.dumps([[item['russian'], item['english'], item['context']] for item in self.data],
+                                 ensure_ascii=False)
+            self.version_hash = hashlib.sha1(content.encode('utf-8')).hexdigest()[:16]
+        return self.version_hash
+    
+    @staticmethod
+    def similarity(first, second):
+        return difflib.SequenceMatcher(None, first.lower(), second.lower()).ratio()
+    
     def find_similar(self, query, threshold=0.3):
         """Ищет похожие фразы в базе знаний"""
         if not query:
             return []
         
-        query_lower = query.lower()
         results = []
         
         for item in self.data:
-            russian_lower = item['russian'].lower()
-            
-            similarity = difflib.SequenceMatcher(None, query_lower, russian_lower).ratio()
+            similarity = self.similarity(query, item['russian'])
             
             if similarity >= threshold:
                 results.append({
@@ -227,6 +310,2688 @@ class KnowledgeBase:
             'exists': len(self.data) > 0
         }
 
+def atomic_write_json(path, data):
+    """Пишет JSON во временный файл и подменяет им старый: при сбое остаётся прежняя версия"""
+    temp_path = path + ".tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(temp_path, path)
+
+class ChatJournal:
+    """Хранилище чатов: журнал JSONL на каждый чат и небольшой индекс.
+    
+    Новое сообщение дописывается одной строкой в журнал своего чата, индекс
+    с названиями и датами переписывается только при создании, очистке и импорте чатов.
+    Очистка тоже пишется в журнал, а мёртвые записи убирает фоновое сжатие.
+    Индекс помнит размер каждого журнала, поэтому при запуске журналы не читаются.
+    """
+    def __init__(self, store_dir, legacy_file=None):
+        self.store_dir = store_dir
+        self.index_file = os.path.join(store_dir, "index.json")
+        self.legacy_file = legacy_file
+        self.lock = threading.Lock()
+        self.record_counts = {}
+        self.compacting = set()
+        self.index = []
+        os.makedirs(store_dir, exist_ok=True)
+    
+    def journal_path(self, chat_id):
+        return os.path.join(self.store_dir, f"chat_{chat_id}.jsonl")
+    
+    def load(self):
+        """Читает метаданные чатов без сообщений; при первом запуске переносит chats_data.json.
+        
+        Журнал перечитывается, только если его размер не совпадает с записанным
+        в индексе (чат менялся после последнего сохранения индекса, например перед сбоем).
+        """
+        if not os.path.exists(self.index_file):
+            self.migrate()
+            if not os.path.exists(self.index_file):
+                return [], {}
+        
+        with open(self.index_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        chats = data.get('chats', [])
+        journals = data.get('journals', {})
+        for chat in chats:
+            saved = journals.get(str(chat['id']))
+            if saved and saved[0] == self.journal_size(chat['id']):
+                self.record_counts[chat['id']] = list(saved[1:])
+            else:
+                self.read_messages(chat)
+            chat['message_count'] = self.record_counts[chat['id']][1]
+            if self.needs_compaction(chat['id']):
+                self.compact_async(chat['id'])
+        self.index = [dict(chat) for chat in chats]
+        return chats, data.get('chat_data', {})
+    
+    def migrate(self):
+        if not self.legacy_file or not os.path.exists(self.legacy_file):
+            return
+        with open(self.legacy_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        chats = data.get('chats', [])
+        for chat in chats:
+            self.write_chat(chat)
+        self.save_index(chats, data.get('chat_data', {}))
+        print(f"Чаты перенесены из {os.path.basename(self.legacy_file)} в журналы ({len(chats)} шт.)")
+    
+    def journal_size(self, chat_id):
+        path = self.journal_path(chat_id)
+        return os.path.getsize(path) if os.path.exists(path) else 0
+    
+    def read_messages(self, chat):
+        """Читает сообщения чата; время последней записи журнала обновляет last_modified"""
+        messages, records, last_at = self.replay(chat['id'])
+        if last_at > chat.get('last_modified', ''):
+            chat['last_modified'] = last_at
+        self.record_counts[chat['id']] = [records, len(messages)]
+        return messages
+    
+    def replay(self, chat_id):
+        """Воспроизводит журнал чата: (сообщения, число записей, время последней записи)"""
+        messages = []
+        records = 0
+        last_at = ''
+        path = self.journal_path(chat_id)
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Строка, недописанная при аварийном завершении
+                        continue
+                    records += 1
+                    if record.get('op') == 'clear':
+                        messages = []
+                    else:
+                        messages.append(record['message'])
+                    last_at = max(last_at, record.get('at', ''))
+        return messages, records, last_at
+    
+    def get_messages(self, chat_id):
+        return self.replay(chat_id)[0]
+    
+    def search_chats(self, term):
+        """Идентификаторы чатов, в названии которых встречается term"""
+        term = term.lower()
+        return [chat['id'] for chat in self.index if term in chat.get('name', '').lower()]
+    
+    def get_statistics(self):
+        """Число сообщений, символов и слов во всех чатах"""
+        stats = {'messages': 0, 'chars': 0, 'words': 0}
+        for chat in self.index:
+            for message in self.get_messages(chat['id']):
+                content = message.get('content', '')
+                stats['messages'] += 1
+                stats['chars'] += len(content)
+                stats['words'] += len(content.split())
+        return stats
+    
+    def close(self):
+        """Журнал пишется сразу, сбрасывать нечего"""
+    
+    def needs_compaction(self, chat_id):
+        """Журнал сжимается, когда мёртвых записей не меньше, чем живых"""
+        records, live = self.record_counts.get(chat_id, [0, 0])
+        return records > live and records - live >= live
+    
+    def _append(self, chat_id, record):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self.lock:
+            with open(self.journal_path(chat_id), 'a', encoding='utf-8') as f:
+                f.write(line)
+            counts = self.record_counts.setdefault(chat_id, [0, 0])
+            counts[0] += 1
+            counts[1] = 0 if record.get('op') == 'clear' else counts[1] + 1
+    
+    def append_message(self, chat_id, message):
+        """Дописывает сообщение в журнал чата, не трогая остальные чаты"""
+        try:
+            self._append(chat_id, {'at': datetime.now().isoformat(), 'message': message})
+        except Exception as e:
+            print(f"Ошибка записи сообщения в журнал: {e}")
+    
+    def clear_chat(self, chat_id):
+        try:
+            self._append(chat_id, {'at': datetime.now().isoformat(), 'op': 'clear'})
+        except Exception as e:
+            print(f"Ошибка записи в журнал: {e}")
+            return
+        if self.needs_compaction(chat_id):
+            self.compact_async(chat_id)
+    
+    def write_chat(self, chat):
+        """Записывает журнал чата целиком (новый или импортированный чат)"""
+        path = self.journal_path(chat['id'])
+        now = chat.get('last_modified') or datetime.now().isoformat()
+        with self.lock:
+            temp_path = path + ".tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                for message in chat.get('messages', []):
+                    f.write(json.dumps({'at': now, 'message': message}, ensure_ascii=False) + "\n")
+            os.replace(temp_path, path)
+            self.record_counts[chat['id']] = [len(chat.get('messages', []))] * 2
+    
+    def save_index(self, chats, chat_data):
+        """Переписывает индекс: метаданные чатов без сообщений и размеры журналов"""
+        try:
+            with self.lock:
+                counts = {chat_id: list(count) for chat_id, count in self.record_counts.items()}
+                journals = {str(chat_id): [self.journal_size(chat_id)] + count
+                            for chat_id, count in counts.items()}
+            self.index = [dict({key: value for key, value in chat.items() if key != 'messages'},
+                               message_count=counts.get(chat['id'], [0, 0])[1])
+                          for chat in chats]
+            data = {
+                'chats': self.index,
+                'chat_data': chat_data,
+                'journals': journals,
+                'saved_at': datetime.now().isoformat()
+            }
+            atomic_write_json(self.index_file, data)
+        except Exception as e:
+            print(f"Ошибка сохранения индекса чатов: {e}")
+    
+    def compact_async(self, chat_id):
+        if chat_id in self.compacting:
+            return
+        self.compacting.add(chat_id)
+        threading.Thread(target=self.compact, args=(chat_id,), daemon=True).start()
+    
+    def compact(self, chat_id):
+        """Переписывает журнал без записей, отменённых очисткой.
+        
+        Основная работа идёт без блокировки; строки, дописанные за это время,
+        переносятся в новый файл перед заменой.
+        """
+        path = self.journal_path(chat_id)
+        temp_path = path + ".compact"
+        try:
+            with self.lock:
+                if not os.path.exists(path):
+                    return
+                snapshot_size = os.path.getsize(path)
+            with open(path, 'rb') as f:
+                lines = self.live_lines(f.read(snapshot_size).splitlines(keepends=True))
+            with open(temp_path, 'wb') as f:
+                f.writelines(lines)
+            
+            with self.lock:
+                with open(path, 'rb') as f:
+                    f.seek(snapshot_size)
+                    tail = f.read().splitlines(keepends=True)
+                with open(temp_path, 'ab') as f:
+                    f.writelines(tail)
+                os.replace(temp_path, path)
+                self.record_counts[chat_id] = [len(lines) + len(tail), len(self.live_lines(lines + tail))]
+        except Exception as e:
+            print(f"Ошибка сжатия журнала чата {chat_id}: {e}")
+        finally:
+            self.compacting.discard(chat_id)
+    
+    @staticmethod
+    def live_lines(lines):
+        """Строки журнала, оставшиеся после последней очистки"""
+        live = []
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if record.get('op') == 'clear':
+                live = []
+            else:
+                live.append(line)
+        return live
+
+class SQLiteChatStore:
+    """Хранилище чатов в SQLite (WAL) с тем же интерфейсом, что у ChatJournal.
+    
+    Сообщения копятся в памяти и записываются пачками в одной транзакции: по размеру
+    пачки или через flush_interval секунд. Перед любым чтением пачка сбрасывается.
+    """
+    # Время изменения чата только растёт: метаданные из окна могут отставать от записанных сообщений
+    UPSERT_CHAT = ("INSERT INTO chats VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(id) DO UPDATE SET "
+                   "name=excluded.name, created_at=excluded.created_at, model=excluded.model, data=excluded.data, "
+                   "last_modified=max(COALESCE(chats.last_modified, ''), COALESCE(excluded.last_modified, ''))")
+    
+    def __init__(self, db_path, journal=None, legacy_file=None, batch_size=50, flush_interval=1.0):
+        self.db_path = db_path
+        self.journal = journal
+        self.legacy_file = legacy_file
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.connection = None
+        self.lock = threading.RLock()
+        self.pending = []
+        self.flush_timer = None
+    
+    def _connect(self):
+        if self.connection is None:
+            directory = os.path.dirname(self.db_path)
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+            self.connection = sqlite3.connect(self.db_path, check_same_thread=False)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            # Встроенный lower() в SQLite не знает кириллицы
+            self.connection.create_function("lower_text", 1, lambda text: text.lower() if text else text,
+                                            deterministic=True)
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS chats ("
+                "id INTEGER PRIMARY KEY, name TEXT NOT NULL, created_at TEXT, "
+                "last_modified TEXT, model TEXT, data TEXT NOT NULL)")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS messages ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, chat_id INTEGER NOT NULL, created_at TEXT NOT NULL, "
+                "role TEXT, content TEXT, words INTEGER NOT NULL, data TEXT NOT NULL)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS messages_chat ON messages (chat_id, created_at)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS chats_modified ON chats (last_modified)")
+            self.connection.commit()
+        return self.connection
+    
+    def _get_setting(self, key, default=None):
+        row = self._connect().execute("SELECT value FROM settings WHERE key=?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+    
+    def _set_setting(self, key, value):
+        self._connect().execute("INSERT OR REPLACE INTO settings VALUES (?, ?)",
+                                (key, json.dumps(value, ensure_ascii=False)))
+    
+    @staticmethod
+    def _chat_row(chat):
+        meta = {key: value for key, value in chat.items() if key != 'messages'}
+        return (chat['id'], chat.get('name', ''), chat.get('created_at'), chat.get('last_modified'),
+                chat.get('model'), json.dumps(meta, ensure_ascii=False))
+    
+    @staticmethod
+    def _message_row(chat_id, message, created_at):
+        content = message.get('content', '')
+        return (chat_id, created_at, message.get('role'), content, len(content.split()),
+                json.dumps(message, ensure_ascii=False))
+    
+    def _insert_messages(self, connection, rows):
+        connection.executemany(
+            "INSERT INTO messages (chat_id, created_at, role, content, words, data) VALUES (?, ?, ?, ?, ?, ?)",
+            rows)
+    
+    def load(self):
+        """Читает метаданные чатов без сообщений; при первом запуске переносит журналы или chats_data.json"""
+        with self.lock:
+            self.flush()
+            connection = self._connect()
+            if not self._get_setting('migrated'):
+                self.migrate()
+            chats = []
+            for last_modified, message_count, data in connection.execute(
+                    "SELECT last_modified, (SELECT COUNT(*) FROM messages WHERE chat_id=chats.id), data "
+                    "FROM chats ORDER BY id"):
+                chat = json.loads(data)
+                chat.update(last_modified=last_modified, message_count=message_count)
+                chats.append(chat)
+            return chats, self._get_setting('chat_data', {})
+    
+    def migrate(self):
+        """Однократный перенос чатов в базу из журналов или из chats_data.json"""
+        if self.journal and os.path.exists(self.journal.index_file):
+            chats, chat_data = self.journal.load()
+            for chat in chats:
+                chat['messages'] = self.journal.get_messages(chat['id'])
+            source = "журналов"
+        elif self.legacy_file and os.path.exists(self.legacy_file):
+            with open(self.legacy_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            chats, chat_data = data.get('chats', []), data.get('chat_data', {})
+            source = os.path.basename(self.legacy_file)
+        else:
+            chats, chat_data, source = [], {}, None
+        
+        connection = self._connect()
+        try:
+            for chat in chats:
+                connection.execute(self.UPSERT_CHAT, self._chat_row(chat))
+                created_at = chat.get('last_modified') or datetime.now().isoformat()
+                self._insert_messages(connection, [self._message_row(chat['id'], message, created_at)
+                                                   for message in chat.get('messages', [])])
+            self._set_setting('chat_data', chat_data)
+            self._set_setting('migrated', datetime.now().isoformat())
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        if source:
+            print(f"Чаты перенесены из {source} в SQLite ({len(chats)} шт.)")
+    
+    def append_message(self, chat_id, message):
+        """Ставит сообщение в очередь пачки; пачка пишется одной транзакцией"""
+        with self.lock:
+            self.pending.append(self._message_row(chat_id, message, datetime.now().isoformat()))
+            if len(self.pending) >= self.batch_size:
+                self.flush()
+            elif self.flush_timer is None:
+                self.flush_timer = threading.Timer(self.flush_interval, self.flush)
+                self.flush_timer.daemon = True
+                self.flush_timer.start()
+    
+    def flush(self):
+        """Записывает накопленные сообщения и время изменения их чатов"""
+        with self.lock:
+            if self.flush_timer is not None:
+                self.flush_timer.cancel()
+                self.flush_timer = None
+            if not self.pending:
+                return
+            rows, self.pending = self.pending, []
+            try:
+                connection = self._connect()
+                self._insert_messages(connection, rows)
+                last_modified = {}
+                for row in rows:
+                    last_modified[row[0]] = row[1]
+                connection.executemany("UPDATE chats SET last_modified=? WHERE id=?",
+                                       [(at, chat_id) for chat_id, at in last_modified.items()])
+                connection.commit()
+            except sqlite3.Error as e:
+                print(f"Ошибка записи сообщений в базу чатов: {e}")
+    
+    def clear_chat(self, chat_id):
+        with self.lock:
+            self.flush()
+            try:
+                self._connect().execute("DELETE FROM messages WHERE chat_id=?", (chat_id,))
+                self.connection.commit()
+            except sqlite3.Error as e:
+                print(f"Ошибка очистки чата в базе: {e}")
+    
+    def write_chat(self, chat):
+        """Записывает чат целиком (новый или импортированный)"""
+        with self.lock:
+            self.flush()
+            connection = self._connect()
+            created_at = chat.get('last_modified') or datetime.now().isoformat()
+            connection.execute(self.UPSERT_CHAT, self._chat_row(chat))
+            connection.execute("DELETE FROM messages WHERE chat_id=?", (chat['id'],))
+            self._insert_messages(connection, [self._message_row(chat['id'], message, created_at)
+                                               for message in chat.get('messages', [])])
+            connection.commit()
+    
+    def save_index(self, chats, chat_data):
+        """Обновляет метаданные чатов без сообщений"""
+        with self.lock:
+            self.flush()
+            try:
+                connection = self._connect()
+                connection.executemany(self.UPSERT_CHAT, [self._chat_row(chat) for chat in chats])
+                self._set_setting('chat_data', chat_data)
+                connection.commit()
+            except sqlite3.Error as e:
+                print(f"Ошибка сохранения чатов в базу: {e}")
+    
+    def get_messages(self, chat_id):
+        with self.lock:
+            self.flush()
+            rows = self._connect().execute(
+                "SELECT data FROM messages WHERE chat_id=? ORDER BY created_at, id", (chat_id,)).fetchall()
+        return [json.loads(data) for data, in rows]
+    
+    def search_chats(self, term):
+        """Идентификаторы чатов, в названии которых встречается term"""
+        with self.lock:
+            rows = self._connect().execute(
+                "SELECT id FROM chats WHERE instr(lower_text(name), ?) > 0 ORDER BY id",
+                (term.lower(),)).fetchall()
+        return [chat_id for chat_id, in rows]
+    
+    def get_statistics(self):
+        """Число сообщений, символов и слов во всех чатах"""
+        with self.lock:
+            self.flush()
+            messages, chars, words = self._connect().execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(content)), 0), COALESCE(SUM(words), 0) "
+                "FROM messages").fetchone()
+        return {'messages': messages, 'chars': chars, 'words': words}
+    
+    def close(self):
+        with self.lock:
+            self.flush()
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+CHAT_STORAGE_BACKENDS = ("journal", "sqlite")
+
+def open_chat_store(data_dir, backend="journal"):
+    """Создаёт хранилище чатов; chats_data.json старых версий переносится при первой загрузке"""
+    legacy_file = os.path.join(data_dir, "chats_data.json")
+    journal = ChatJournal(os.path.join(data_dir, "chats"), legacy_file)
+    if backend == "sqlite":
+        return SQLiteChatStore(os.path.join(data_dir, "chats.sqlite3"), journal, legacy_file)
+    return journal
+
+class PersistenceWriter:
+    """Фоновая запись состояния окна на диск.
+    
+    mark_dirty только отмечает цель изменённой, поэтому окно не ждёт диска. Поток
+    объединяет отметки и пишет не чаще раза в interval секунд; flush пишет сразу.
+    """
+    def __init__(self, interval=2.0):
+        self.interval = interval
+        self.targets = {}
+        self.dirty = set()
+        self.condition = threading.Condition()
+        self.write_lock = threading.Lock()
+        self.last_write = 0.0
+        self.stopped = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+    
+    def register(self, name, save):
+        self.targets[name] = save
+    
+    def mark_dirty(self, name):
+        with self.condition:
+            self.dirty.add(name)
+            self.condition.notify()
+    
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.dirty and not self.stopped:
+                    self.condition.wait()
+                if self.stopped:
+                    return
+                delay = self.last_write + self.interval - time.time()
+                if delay > 0:
+                    # Отметки, пришедшие за это время, попадут в ту же запись
+                    self.condition.wait(delay)
+                    continue
+            self.write_dirty()
+    
+    def write_dirty(self):
+        with self.write_lock:
+            with self.condition:
+                names, self.dirty = self.dirty, set()
+                self.last_write = time.time()
+            for name in names:
+                try:
+                    self.targets[name]()
+                except Exception as e:
+                    print(f"Ошибка фоновой записи {name}: {e}")
+    
+    def flush(self):
+        """Пишет все изменённые цели немедленно, в вызывающем потоке"""
+        self.write_dirty()
+    
+    def close(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        self.flush()
+
+class TranslationResult:
+    def __init__(self, text, src, dest):
+        self.text = text
+        self.src = src
+        self.dest = dest
+
+def detect_script(text):
+    """Определяет преобладающую письменность: 'cyrillic', 'latin' или None, если букв нет"""
+    cyrillic = len(re.findall('[а-яА-ЯёЁ]', text))
+    latin = len(re.findall('[a-zA-Z]', text))
+    if not cyrillic and not latin:
+        return None
+    return 'cyrillic' if cyrillic >= latin else 'latin'
+
+def needs_translation(text, dest):
+    """Нужен ли перевод на dest: для ru и en сравнивается письменность, для остальных — всегда"""
+    if not text or not text.strip():
+        return False
+    if dest not in ('ru', 'en'):
+        return True
+    script = detect_script(text)
+    return script is not None and script != ('cyrillic' if dest == 'ru' else 'latin')
+
+class TranslatorBackend:
+    """Интерфейс переводчика: translate для одной строки, translate_batch для списка"""
+    name = "base"
+    
+    def translate(self, text, dest='en', src='auto'):
+        return self.translate_batch([text], dest, src)[0]
+    
+    def translate_batch(self, texts, dest='en', src='auto'):
+        return [self.translate(text, dest, src) for text in texts]
+    
+    @staticmethod
+    def detect_language(text):
+        return 'ru' if detect_script(text) == 'cyrillic' else 'en'
+
+class GoogleTranslatorBackend(TranslatorBackend):
+    """Онлайн-перевод через googletrans"""
+    name = "google"
+    
+    def __init__(self):
+        self.translator = Translator()
+    
+    def translate(self, text, dest='en', src='auto'):
+        translation = self.translator.translate(text, dest=dest, src=src)
+        return TranslationResult(translation.text, translation.src, dest)
+
+class MarianTranslatorBackend(TranslatorBackend):
+    """Локальный перевод ru↔en моделями Helsinki-NLP Marian, предложения переводятся пачками"""
+    name = "marian"
+    MODELS = {
+        ('ru', 'en'): "Helsinki-NLP/opus-mt-ru-en",
+        ('en', 'ru'): "Helsinki-NLP/opus-mt-en-ru"
+    }
+    # Граница предложения или перевод строки; разделители сохраняются при сборке текста
+    SPLIT_PATTERN = re.compile(r'((?<=[.!?…])\s+|\n+)')
+    
+    def __init__(self, batch_size=16, max_sentence_chars=400):
+        self.batch_size = batch_size
+        self.max_sentence_chars = max_sentence_chars
+        self.models = {}
+        self.lock = threading.Lock()
+    
+    def _load(self, pair):
+        with self.lock:
+            if pair not in self.models:
+                from transformers import MarianMTModel, MarianTokenizer
+                repo_id = self.MODELS[pair]
+                print(f"Загрузка модели перевода {repo_id}...")
+                tokenizer = MarianTokenizer.from_pretrained(repo_id)
+                model = MarianMTModel.from_pretrained(repo_id)
+                device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+                self.models[pair] = (tokenizer, model.to(device).eval(), device)
+            return self.models[pair]
+    
+    def split_sentences(self, text):
+        """Делит текст на части: чётные — предложения, нечётные — разделители между ними"""
+        parts = []
+        for index, part in enumerate(self.SPLIT_PATTERN.split(text)):
+            if index % 2 or len(part) <= self.max_sentence_chars:
+                parts.append(part)
+                continue
+            # Слишком длинное предложение режется по пробелам
+            words, chunk = part.split(' '), ""
+            for word in words:
+                if chunk and len(chunk) + len(word) + 1 > self.max_sentence_chars:
+                    parts.extend([chunk, " "])
+                    chunk = word
+                else:
+                    chunk = f"{chunk} {word}" if chunk else word
+            parts.append(chunk)
+        return parts
+    
+    def _generate(self, pair, sentences):
+        tokenizer, model, device = self._load(pair)
+        translated = [None] * len(sentences)
+        # Похожие по длине предложения в одной пачке — меньше паддинга
+        order = sorted(range(len(sentences)), key=lambda i: len(sentences[i]))
+        for start in range(0, len(order), self.batch_size):
+            indices = order[start:start + self.batch_size]
+            batch = tokenizer([sentences[i] for i in indices], return_tensors="pt",
+                              padding=True, truncation=True).to(device)
+            with torch.no_grad():
+                output = model.generate(**batch, max_new_tokens=512)
+            for i, text in zip(indices, tokenizer.batch_decode(output, skip_special_tokens=True)):
+                translated[i] = text
+        return translated
+    
+    def translate_batch(self, texts, dest='en', src='auto'):
+        layouts = []
+        pending = {}
+        for text in texts:
+            text_src = self.detect_language(text) if src == 'auto' else src
+            parts = self.split_sentences(text)
+            layouts.append((text_src, parts))
+            if text_src == dest:
+                continue
+            if (text_src, dest) not in self.MODELS:
+                raise ValueError(f"Перевод {text_src}→{dest} не поддерживается локальным переводчиком")
+            for part in parts[::2]:
+                if part.strip():
+                    pending.setdefault((text_src, dest), set()).add(part)
+        
+        translations = {}
+        for pair, sentences in pending.items():
+            sentences = list(sentences)
+            translations[pair] = dict(zip(sentences, self._generate(pair, sentences)))
+        
+        results = []
+        for text_src, parts in layouts:
+            table = translations.get((text_src, dest), {})
+            joined = "".join(table.get(part, part) if index % 2 == 0 else part
+                             for index, part in enumerate(parts))
+            results.append(TranslationResult(joined, text_src, dest))
+        return results
+
+class StubTranslatorBackend(TranslatorBackend):
+    """Переводчик для тестов: возвращает текст без изменений, сеть и модели не нужны"""
+    name = "stub"
+    
+    def translate(self, text, dest='en', src='auto'):
+        return TranslationResult(text, self.detect_language(text) if src == 'auto' else src, dest)
+
+TRANSLATOR_BACKENDS = {
+    GoogleTranslatorBackend.name: GoogleTranslatorBackend,
+    MarianTranslatorBackend.name: MarianTranslatorBackend,
+    StubTranslatorBackend.name: StubTranslatorBackend
+}
+
+class CachedTranslator(TranslatorBackend):
+    """Обёртка над переводчиком с постоянным кэшем в SQLite и вытеснением давно не использованных строк.
+    
+    Предохранитель breaker стоит только перед обращением к самому переводчику:
+    переводы из кэша отдаются всегда и не считаются ни сбоями, ни медленными вызовами.
+    """
+    def __init__(self, translator, db_path, max_entries=20000, breaker=None):
+        self.translator = translator
+        self.name = translator.name
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.breaker = breaker
+        self.connection = None
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def _connect(self):
+        if self.connection is None:
+            directory = os.path.dirname(self.db_path)
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+            self.connection = sqlite3.connect(self.db_path, check_same_thread=False)
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS translations ("
+                "text_hash TEXT NOT NULL, src TEXT NOT NULL, dest TEXT NOT NULL, "
+                "translated TEXT NOT NULL, detected_src TEXT, used REAL NOT NULL, "
+                "PRIMARY KEY (text_hash, src, dest))")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS translations_used ON translations (used)")
+            self.connection.commit()
+        return self.connection
+    
+    @staticmethod
+    def text_hash(text):
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+    
+    def _lookup(self, connection, key):
+        row = connection.execute(
+            "SELECT translated, detected_src FROM translations WHERE text_hash=? AND src=? AND dest=?",
+            key).fetchone()
+        if row:
+            connection.execute("UPDATE translations SET used=? WHERE text_hash=? AND src=? AND dest=?",
+                               (time.time(),) + key)
+        return row
+    
+    def translate_batch(self, texts, dest='en', src='auto', breaker=None):
+        """Переводит тексты, обращаясь к переводчику только за теми, которых нет в кэше.
+        
+        breaker заменяет общий предохранитель (фоновые задачи не должны размыкать цепь запросов).
+        При сбое переводчика бросает TranslationUnavailable с переводами из кэша в partial.
+        """
+        results = [None] * len(texts)
+        missing = []
+        with self.lock:
+            try:
+                connection = self._connect()
+                for index, text in enumerate(texts):
+                    if not text or not text.strip():
+                        results[index] = TranslationResult(text, src, dest)
+                        continue
+                    row = self._lookup(connection, (self.text_hash(text), src, dest))
+                    if row:
+                        results[index] = TranslationResult(row[0], row[1] or src, dest)
+                    else:
+                        missing.append(index)
+                connection.commit()
+            except sqlite3.Error as e:
+                print(f"Ошибка кэша переводов: {e}")
+                missing = [index for index, result in enumerate(results) if result is None]
+        
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+        if not missing:
+            return results
+        
+        breaker = breaker or self.breaker
+        batch = [texts[index] for index in missing]
+        try:
+            if breaker:
+                translations = breaker.call(self.translator.translate_batch, batch, dest, src)
+            else:
+                translations = self.translator.translate_batch(batch, dest, src)
+        except Exception as e:
+            raise TranslationUnavailable(str(e), partial=results) from e
+        
+        with self.lock:
+            try:
+                connection = self._connect()
+                for index, translation in zip(missing, translations):
+                    results[index] = translation
+                    connection.execute("INSERT OR REPLACE INTO translations VALUES (?, ?, ?, ?, ?, ?)",
+                                       (self.text_hash(texts[index]), src, dest,
+                                        translation.text, translation.src, time.time()))
+                # Вытесняются давно не использованные переводы сверх лимита
+                connection.execute(
+                    "DELETE FROM translations WHERE rowid IN (SELECT rowid FROM translations "
+                    "ORDER BY used DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+                connection.commit()
+            except sqlite3.Error as e:
+                print(f"Ошибка кэша переводов: {e}")
+        
+        return results
+    
+    def clear(self):
+        with self.lock:
+            self._connect().execute("DELETE FROM translations")
+            self.connection.commit()
+    
+    def get_stats(self):
+        with self.lock:
+            entries = self._connect().execute("SELECT COUNT(*) FROM translations").fetchone()[0]
+        return {'entries': entries, 'hits': self.hits, 'misses': self.misses}
+
+def default_translator_backend():
+    if GOOGLETRANS_AVAILABLE:
+        return "google"
+    return "marian" if TRANSFORMERS_AVAILABLE else None
+
+def set_translator_backend(name, breaker=None):
+    """Подменяет модульный translator выбранной реализацией (с кэшем переводов и предохранителем)"""
+    global translator, TRANSLATOR_AVAILABLE
+    name = name or default_translator_backend()
+    if name == "google" and not GOOGLETRANS_AVAILABLE or name == "marian" and not TRANSFORMERS_AVAILABLE:
+        print(f"Переводчик {name} недоступен")
+        name = None
+    
+    if name not in TRANSLATOR_BACKENDS:
+        translator, TRANSLATOR_AVAILABLE = None, False
+        return None
+    
+    backend = TRANSLATOR_BACKENDS[name]()
+    if name != StubTranslatorBackend.name:
+        backend = CachedTranslator(backend, os.path.join(os.path.expanduser("~"), "Documents", "TrainsFormerAI",
+                                                         "cache", f"translations_{name}.sqlite3"),
+                                   breaker=breaker)
+    translator, TRANSLATOR_AVAILABLE = backend, True
+    return name
+
+class TranslationUnavailable(Exception):
+    """Переводчик недоступен; partial — переводы пачки, известные без него (None для остальных)"""
+    def __init__(self, message, partial=None):
+        super().__init__(message)
+        self.partial = partial
+
+class CircuitBreaker:
+    """Ограничивает время вызова и отключает его на время после серии сбоев или медленных ответов"""
+    def __init__(self, timeout=5.0, slow_after=3.0, max_failures=3, cooldown=60.0,
+                 load_timeout=60.0, max_workers=2):
+        self.timeout = timeout
+        self.slow_after = slow_after
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+        # Первый вызов загружает модель перевода (Marian) и не считается медленным
+        self.load_timeout = load_timeout
+        self.max_workers = max_workers
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.warmed_up = False
+        self.in_flight = 0
+        # Условие оповещает ожидающих о замыкании цепи
+        self.lock = threading.Condition()
+        # Общий ограниченный пул: зависшие вызовы не плодят новые потоки
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="breaker")
+    
+    def _state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if self.opened_at + self.cooldown > time.time():
+            return 'open'
+        return 'half_open'
+    
+    def get_state(self):
+        """Состояние цепи; 'busy' — цепь не разомкнута, но все потоки заняты зависшими вызовами"""
+        with self.lock:
+            state = self._state()
+            retry_in = round(self.opened_at + self.cooldown - time.time()) if state == 'open' else 0
+            if state != 'open' and self.in_flight >= self.max_workers:
+                state = 'busy'
+            return {'state': state, 'failures': self.failures, 'retry_in': retry_in}
+    
+    def reset(self):
+        """Сбрасывает счётчик сбоев, например после смены реализации перевода"""
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.warmed_up = False
+            self.lock.notify_all()
+    
+    def wait_until_available(self):
+        """Блокирует, пока цепь разомкнута (до конца паузы или сброса)"""
+        with self.lock:
+            while self._state() == 'open':
+                self.lock.wait(self.opened_at + self.cooldown - time.time())
+    
+    def _acquire(self):
+        """Резервирует место для вызова; в полуоткрытом состоянии пропускает ровно один пробный вызов"""
+        with self.lock:
+            state = self._state()
+            if state == 'open':
+                raise TranslationUnavailable("перевод временно отключён после сбоев")
+            if state == 'half_open' and self.trial_running:
+                raise TranslationUnavailable("перевод проверяется пробным вызовом")
+            if self.in_flight >= self.max_workers:
+                raise TranslationUnavailable("все потоки перевода заняты")
+            self.trial_running = state == 'half_open'
+            self.in_flight += 1
+            return not self.warmed_up
+    
+    def _release(self, future):
+        with self.lock:
+            self.in_flight -= 1
+    
+    def _record(self, success):
+        with self.lock:
+            self.trial_running = False
+            if success:
+                self.failures = 0
+                self.opened_at = None
+                self.lock.notify_all()
+                return
+            self.failures += 1
+            # После пробного вызова в полуоткрытом состоянии один сбой снова размыкает цепь
+            if self.failures >= self.max_failures or self.opened_at is not None:
+                self.opened_at = time.time()
+    
+    def call(self, func, *args, **kwargs):
+        """Вызывает func с таймаутом; при разомкнутой цепи сразу бросает TranslationUnavailable"""
+        loading = self._acquire()
+        timeout = max(self.timeout, self.load_timeout) if loading else self.timeout
+        
+        start = time.time()
+        future = self.executor.submit(func, *args, **kwargs)
+        # Место освобождается, только когда вызов действительно завершился
+        future.add_done_callback(self._release)
+        try:
+            result = future.result(timeout)
+        except FutureTimeoutError:
+            # Зависший вызов остаётся в пуле, запрос дальше его не ждёт
+            self._record(False)
+            raise TranslationUnavailable(f"перевод не уложился в {timeout:g} с")
+        except Exception:
+            self._record(False)
+            raise
+        elapsed = time.time() - start
+        
+        if loading:
+            with self.lock:
+                self.warmed_up = True
+        self._record(loading or elapsed < self.slow_after)
+        return result
+
+class AnswerCache:
+    """Постоянный кэш ответов помощника с поиском по похожести вопроса.
+    
+    Файл переписывается фоновым PersistenceWriter не чаще раза в save_interval секунд.
+    """
+    def __init__(self, path, max_entries=1000, save_interval=5.0):
+        self.path = path
+        self.max_entries = max_entries
+        self.entries = []
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.lookups = 0
+        self.load()
+        self.writer = PersistenceWriter(save_interval)
+        self.writer.register('answers', self.save)
+    
+    def load(self):
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self.entries = json.load(f)
+        except Exception as e:
+            print(f"Ошибка загрузки кэша ответов: {e}")
+            self.entries = []
+    
+    def save(self):
+        with self.lock:
+            entries = [dict(entry) for entry in self.entries]
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            atomic_write_json(self.path, entries)
+        except Exception as e:
+            print(f"Ошибка сохранения кэша ответов: {e}")
+    
+    def close(self):
+        """Дописывает несохранённые ответы и останавливает фоновую запись"""
+        self.writer.close()
+    
+    @staticmethod
+    def make_key(model_name, settings, kb_version, **options):
+        """Ключ: модель, параметры генерации, версия базы знаний и прочие настройки,
+        от которых зависит текст ответа (стоп-строки, переводчик, режим перевода)"""
+        params = {'response_length': settings.get('response_length', 100),
+                  'temperature': settings.get('temperature', 0.7),
+                  'neuroshift': settings.get('neuroshift', True),
+                  **options}
+        return "|".join([model_name, kb_version, json.dumps(params, sort_keys=True, ensure_ascii=False)])
+    
+    def lookup(self, key, question, threshold):
+        """Возвращает сохранённый ответ на самый похожий вопрос или None"""
+        with self.lock:
+            self.lookups += 1
+            best, best_similarity = None, threshold
+            for entry in self.entries:
+                if entry['key'] != key:
+                    continue
+                similarity = KnowledgeBase.similarity(question, entry['question'])
+                if similarity >= best_similarity:
+                    best, best_similarity = entry, similarity
+            if best is None:
+                return None
+            
+            self.hits += 1
+            best['used'] = time.time()
+            return dict(best['result'], similarity=best_similarity)
+    
+    def store(self, key, question, result):
+        with self.lock:
+            self.entries = [entry for entry in self.entries
+                            if not (entry['key'] == key and entry['question'] == question)]
+            self.entries.append({'key': key, 'question': question, 'result': result, 'used': time.time()})
+            if len(self.entries) > self.max_entries:
+                # Вытесняются давно не использованные ответы
+                self.entries.sort(key=lambda entry: entry['used'])
+                self.entries = self.entries[-self.max_entries:]
+        self.writer.mark_dirty('answers')
+    
+    def clear(self):
+        with self.lock:
+            self.entries = []
+        self.writer.mark_dirty('answers')
+
+class GenerationStopper(StoppingCriteria):
+    """Останавливает генерацию по стоп-строкам или по кнопке «Стоп»"""
+    def __init__(self, tokenizer, prompt_length, stop_strings=(), cancel_event=None):
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+        self.stop_strings = [stop for stop in stop_strings if stop]
+        self.cancel_event = cancel_event
+        self.window = max([len(stop) for stop in self.stop_strings] + [0]) + 8
+    
+    def __call__(self, input_ids, scores, **kwargs):
+        done = self.cancel_event is not None and self.cancel_event.is_set()
+        if not done and self.stop_strings:
+            tail_ids = input_ids[0][self.prompt_length:][-self.window:]
+            tail = self.tokenizer.decode(tail_ids, skip_special_tokens=True)
+            done = any(stop in tail for stop in self.stop_strings)
+        return torch.full((input_ids.shape[0],), done, dtype=torch.bool, device=input_ids.device)
+
+class CallbackStreamer(TextStreamer):
+    """Передаёт callback'у сгенерированный текст по мере готовности слов (без промпта)"""
+    def __init__(self, tokenizer, callback, **decode_kwargs):
+        super().__init__(tokenizer, skip_prompt=True, skip_special_tokens=True, **decode_kwargs)
+        self.callback = callback
+    
+    def on_finalized_text(self, text, stream_end=False):
+        if text:
+            self.callback(text)
+
+class SentenceTranslationPipeline:
+    """Переводит ответ по предложениям, пока модель продолжает генерацию.
+    
+    Законченные предложения сразу уходят в пул потоков на перевод, on_sentence
+    получает переводы строго по порядку, вместе с разделителем после предложения.
+    """
+    SENTENCE_END = re.compile(r'[.!?…]+["»)\]]*\s+|\n+')
+    
+    def __init__(self, translate, on_sentence=None, stop_strings=(), workers=2):
+        self.translate = translate
+        self.on_sentence = on_sentence
+        self.stop_strings = [stop for stop in stop_strings if stop]
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.lock = threading.Lock()
+        self.buffer = ""
+        self.stopped = False
+        self.segments = []
+        self.translated = []
+        self.failed = False
+    
+    def feed(self, text):
+        """Принимает очередной кусок английского текста от генерации"""
+        if self.stopped:
+            return
+        self.buffer += text
+        for stop in self.stop_strings:
+            index = self.buffer.find(stop)
+            if index != -1:
+                self.buffer = self.buffer[:index]
+                self.stopped = True
+        start = 0
+        for match in self.SENTENCE_END.finditer(self.buffer):
+            self._submit(self.buffer[start:match.end()])
+            start = match.end()
+        self.buffer = self.buffer[start:]
+    
+    def _submit(self, segment):
+        sentence = segment.strip()
+        if not sentence:
+            return
+        separator = "\n" if "\n" in segment[len(segment.rstrip()):] else " "
+        future = self.executor.submit(self.translate, sentence)
+        self.segments.append((sentence, separator, future))
+        future.add_done_callback(self._emit_ready)
+    
+    def _emit_ready(self, future):
+        # Короткое предложение может перевестись раньше предыдущего, поэтому
+        # выдаётся только непрерывный готовый префикс
+        with self.lock:
+            while len(self.translated) < len(self.segments):
+                sentence, separator, pending = self.segments[len(self.translated)]
+                if not pending.done():
+                    break
+                try:
+                    text = pending.result() or sentence
+                except Exception as e:
+                    print(f"Перевод предложения пропущен: {e}")
+                    text = sentence
+                    self.failed = True
+                self.translated.append(text + separator)
+                if self.on_sentence:
+                    self.on_sentence(text + separator)
+    
+    def finish(self):
+        """Переводит хвост без знака конца предложения, дожидается всех переводов и возвращает ответ"""
+        self._submit(self.buffer)
+        self.buffer = ""
+        self.executor.shutdown(wait=True)
+        return "".join(self.translated).strip()
+
+class ProcessMemoryCounters(ctypes.Structure):
+    """Структура PROCESS_MEMORY_COUNTERS из psapi.h"""
+    _fields_ = [('cb', ctypes.c_ulong), ('PageFaultCount', ctypes.c_ulong)] + [
+        (name, ctypes.c_size_t) for name in (
+            'PeakWorkingSetSize', 'WorkingSetSize', 'QuotaPeakPagedPoolUsage', 'QuotaPagedPoolUsage',
+            'QuotaPeakNonPagedPoolUsage', 'QuotaNonPagedPoolUsage', 'PagefileUsage', 'PeakPagefileUsage')]
+
+class MemoryMonitor:
+    """Фоново замеряет RSS процесса и запоминает пик за время измерения"""
+    def __init__(self, interval=0.02):
+        self.interval = interval
+        self.start_mb = None
+        self.peak_mb = None
+        self._stop = threading.Event()
+        self._thread = None
+    
+    @staticmethod
+    def current_rss_mb():
+        """Текущий RSS процесса в МБ или None, если его не узнать"""
+        if PSUTIL_AVAILABLE:
+            return psutil.Process().memory_info().rss / (1024 * 1024)
+        if sys.platform == 'win32':
+            return MemoryMonitor.windows_working_set_mb()
+        try:
+            with open('/proc/self/statm') as f:
+                pages = int(f.read().split()[1])
+            return pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+        except (OSError, ValueError, AttributeError):
+            return None
+    
+    @staticmethod
+    def windows_working_set_mb():
+        """Рабочий набор процесса в Windows через GetProcessMemoryInfo (без psutil)"""
+        try:
+            counters = ProcessMemoryCounters()
+            counters.cb = ctypes.sizeof(counters)
+            kernel32 = ctypes.windll.kernel32
+            kernel32.GetCurrentProcess.restype = ctypes.c_void_p
+            get_info = ctypes.windll.psapi.GetProcessMemoryInfo
+            get_info.argtypes = [ctypes.c_void_p, ctypes.POINTER(ProcessMemoryCounters), ctypes.c_ulong]
+            if not get_info(kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb):
+                return None
+            return counters.WorkingSetSize / (1024 * 1024)
+        except (OSError, AttributeError):
+            return None
+    
+    def _sample(self):
+        while not self._stop.is_set():
+            rss = self.current_rss_mb()
+            if rss is not None:
+                self.peak_mb = max(self.peak_mb or 0, rss)
+            self._stop.wait(self.interval)
+    
+    def __enter__(self):
+        self.start_mb = self.current_rss_mb()
+        self.peak_mb = self.start_mb
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+    
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        rss = self.current_rss_mb()
+        if rss is not None:
+            self.peak_mb = max(self.peak_mb or 0, rss)
+        return False
+
+def prefill_in_chunks(model, input_ids, past_key_values, start, end, chunk_size=0):
+    """Досчитывает KV-кэш для токенов [start, end) кусками по chunk_size токенов.
+    
+    Пиковая память на активации внимания ограничена размером куска, а не длиной промпта.
+    """
+    step = chunk_size if chunk_size and chunk_size > 0 else end - start
+    with torch.no_grad():
+        for chunk_start in range(start, end, step):
+            outputs = model(input_ids[:, chunk_start:min(chunk_start + step, end)],
+                            past_key_values=past_key_values,
+                            use_cache=True)
+            past_key_values = outputs.past_key_values
+    return past_key_values
+
+def percentile(values, q):
+    """Перцентиль q (0–100) с линейной интерполяцией"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+class StageTimer:
+    """Замеряет длительность этапов обработки одного запроса"""
+    def __init__(self):
+        self.timings = {}
+    
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + time.perf_counter() - start
+
+class MetricsRecorder:
+    """Пишет метрики запросов в JSONL и хранит скользящее окно для p50/p95 по этапам"""
+    def __init__(self, path, window=200):
+        self.path = path
+        self.window = window
+        self.samples = {}
+        self.lock = threading.Lock()
+    
+    def observe(self, kind, timings):
+        with self.lock:
+            stages = self.samples.setdefault(kind, {})
+            for stage, seconds in timings.items():
+                stages.setdefault(stage, deque(maxlen=self.window)).append(seconds)
+    
+    def record(self, kind, model_name, timings, prompt_tokens, new_tokens, memory=None):
+        """Добавляет запись о запросе и возвращает её"""
+        timings = dict(timings)
+        timings['total'] = sum(timings.values())
+        generate_time = timings.get('generate', 0.0)
+        entry = {
+            'time': datetime.now().isoformat(),
+            'kind': kind,
+            'model': model_name,
+            'timings': {stage: round(seconds, 4) for stage, seconds in timings.items()},
+            'prompt_tokens': prompt_tokens,
+            'new_tokens': new_tokens,
+            'tokens_per_s': round(new_tokens / generate_time, 2) if generate_time else 0.0,
+            'memory': memory or {}
+        }
+        self.observe(kind, timings)
+        
+        try:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            with self.lock, open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        except Exception as e:
+            print(f"Ошибка записи метрик: {e}")
+        return entry
+    
+    def summary(self, kind):
+        """Возвращает {этап: (p50, p95)} по последним запросам данного вида"""
+        with self.lock:
+            return {stage: (percentile(values, 50), percentile(values, 95))
+                    for stage, values in self.samples.get(kind, {}).items()}
+
+class RequestProfiler:
+    """Снимает cProfile и torch.profiler (CPU) для одного запроса и сохраняет их в папку логов"""
+    def __init__(self, log_dir, kind):
+        self.log_dir = log_dir
+        self.kind = kind
+        self.profile = cProfile.Profile()
+        self.torch_profile = None
+        self.paths = []
+    
+    def __enter__(self):
+        if TRANSFORMERS_AVAILABLE and hasattr(torch, 'profiler'):
+            try:
+                self.torch_profile = torch.profiler.profile(
+                    activities=[torch.profiler.ProfilerActivity.CPU],
+                    record_shapes=True)
+                self.torch_profile.__enter__()
+            except Exception as e:
+                print(f"torch.profiler недоступен: {e}")
+                self.torch_profile = None
+        self.profile.enable()
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.profile.disable()
+        if self.torch_profile is not None:
+            self.torch_profile.__exit__(*exc_info)
+        
+        if not os.path.exists(self.log_dir):
+            os.makedirs(self.log_dir)
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        
+        pstats_path = os.path.join(self.log_dir, f"profile_{self.kind}_{stamp}.pstats")
+        self.profile.dump_stats(pstats_path)
+        self.paths.append(pstats_path)
+        
+        if self.torch_profile is not None:
+            trace_path = os.path.join(self.log_dir, f"trace_{self.kind}_{stamp}.json")
+            try:
+                self.torch_profile.export_chrome_trace(trace_path)
+                self.paths.append(trace_path)
+            except Exception as e:
+                print(f"Ошибка сохранения trace: {e}")
+        
+        print("Профиль запроса сохранён: " + ", ".join(self.paths))
+        return False
+
+class ModelPool:
+    def __init__(self, budget_mb=2048):
+        self.budget_mb = budget_mb
+        self.entries = OrderedDict()
+        self.known_sizes = {}
+        self.loading = {}
+        self.pinned = None
+        self.lock = threading.RLock()
+    
+    @staticmethod
+    def model_size_mb(model):
+        """Оценивает объём памяти, занимаемый весами модели"""
+        total = 0
+        for tensor in list(model.parameters()) + list(model.buffers()):
+            total += tensor.numel() * tensor.element_size()
+        return total / (1024 * 1024)
+    
+    def total_mb(self):
+        with self.lock:
+            return sum(entry['size_mb'] for entry in self.entries.values())
+    
+    def get(self, name):
+        """Возвращает модель из пула и помечает её как недавно использованную"""
+        with self.lock:
+            entry = self.entries.get(name)
+            if entry:
+                self.entries.move_to_end(name)
+            return entry
+    
+    def is_loading(self, name):
+        with self.lock:
+            return name in self.loading
+    
+    def pin(self, name):
+        """Защищает активную модель от вытеснения"""
+        with self.lock:
+            self.pinned = name
+            if name in self.entries:
+                self.entries.move_to_end(name)
+            self.evict()
+    
+    def load(self, name, loader):
+        """Возвращает модель из пула или загружает её через loader"""
+        while True:
+            entry = self.get(name)
+            if entry:
+                return entry
+            
+            with self.lock:
+                event = self.loading.get(name)
+                owner = event is None
+                if owner:
+                    event = threading.Event()
+                    self.loading[name] = event
+            
+            if not owner:
+                event.wait()
+                continue
+            
+            try:
+                tokenizer, model, device = loader(name)
+                entry = {
+                    'tokenizer': tokenizer,
+                    'model': model,
+                    'device': device,
+                    'size_mb': self.model_size_mb(model)
+                }
+                with self.lock:
+                    self.entries[name] = entry
+                    self.known_sizes[name] = entry['size_mb']
+                    self.evict(keep=name)
+                print(f"Модель {name} в пуле ({entry['size_mb']:.0f} МБ, всего {self.total_mb():.0f}/{self.budget_mb} МБ)")
+                return entry
+            finally:
+                with self.lock:
+                    self.loading.pop(name, None)
+                event.set()
+    
+    def preload(self, name, loader):
+        """Загружает модель в фоне, если она не в пуле и помещается в бюджет"""
+        with self.lock:
+            if name in self.entries or name in self.loading:
+                return False
+            if self.total_mb() + self.known_sizes.get(name, 0) > self.budget_mb:
+                return False
+        
+        def preload_thread():
+            try:
+                self.load(name, loader)
+            except Exception as e:
+                print(f"Ошибка фоновой загрузки модели {name}: {e}")
+        
+        threading.Thread(target=preload_thread, daemon=True).start()
+        return True
+    
+    def evict(self, keep=None):
+        """Вытесняет давно не использованные модели, пока пул не уложится в бюджет"""
+        evicted = False
+        with self.lock:
+            protected = {keep, self.pinned}
+            while self.total_mb() > self.budget_mb:
+                candidates = [name for name in self.entries if name not in protected]
+                if not candidates:
+                    break
+                name = candidates[0]
+                entry = self.entries.pop(name)
+                print(f"Модель {name} выгружена из пула ({entry['size_mb']:.0f} МБ)")
+                del entry
+                evicted = True
+        
+        if not evicted:
+            return
+        gc.collect()
+        if TRANSFORMERS_AVAILABLE and torch.cuda.is_available():
+            torch.cuda.empty_cache()
+    
+    def set_budget(self, budget_mb):
+        with self.lock:
+            self.budget_mb = budget_mb
+            self.evict()
+    
+    def clear(self):
+        """Выгружает все модели, включая активную; следующий запрос загрузит их заново"""
+        with self.lock:
+            names = list(self.entries)
+            self.entries.clear()
+        if names:
+            print(f"Модели выгружены из пула: {', '.join(names)}")
+        gc.collect()
+        if TRANSFORMERS_AVAILABLE and torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+class PrefixCache:
+    """Префиксное дерево по id токенов с KV-состояниями уже посчитанных префиксов промпта"""
+    def __init__(self, budget_mb=256):
+        self.budget_mb = budget_mb
+        self.root = {'key': None, 'parent': None, 'children': {}, 'kv': None, 'size_mb': 0}
+        self.entries = OrderedDict()
+        self.total_mb = 0
+        self.lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+        self.reused_tokens = 0
+        self.total_tokens = 0
+    
+    @staticmethod
+    def kv_layers(kv):
+        """Возвращает список пар (keys, values) по слоям для любого формата KV-кэша"""
+        if isinstance(kv, (tuple, list)):
+            return [(layer[0], layer[1]) for layer in kv]
+        if hasattr(kv, 'layers'):
+            return [(layer.keys, layer.values) for layer in kv.layers if layer.keys is not None]
+        return list(zip(getattr(kv, 'key_cache', []), getattr(kv, 'value_cache', [])))
+    
+    @staticmethod
+    def make_kv(layers, legacy=False):
+        """Собирает KV-кэш из пар (keys, values): кортежи для старых версий transformers"""
+        if legacy or DynamicCache is None:
+            return tuple((keys, values) for keys, values in layers)
+        kv = DynamicCache()
+        for layer_idx, (keys, values) in enumerate(layers):
+            kv.update(keys, values, layer_idx)
+        return kv
+    
+    @classmethod
+    def kv_tensors(cls, kv):
+        return [tensor for layer in cls.kv_layers(kv) for tensor in layer]
+    
+    @classmethod
+    def kv_size_mb(cls, kv):
+        return sum(t.numel() * t.element_size() for t in cls.kv_tensors(kv)) / (1024 * 1024)
+    
+    @staticmethod
+    def copy_kv(kv, length):
+        """Возвращает независимую копию KV, обрезанную до length токенов"""
+        if isinstance(kv, (tuple, list)):
+            return tuple(tuple(t[:, :, :length, :].clone() for t in layer) for layer in kv)
+        kv = copy.deepcopy(kv)
+        extra = kv.get_seq_length() - length
+        if extra > 0:
+            kv.crop(-extra)
+        return kv
+    
+    def lookup(self, namespace, token_ids):
+        """Возвращает копию KV самого длинного закешированного префикса и его длину"""
+        with self.lock:
+            self.lookups += 1
+            self.total_tokens += len(token_ids)
+            
+            node = self.root['children'].get(namespace)
+            depth = 0
+            # Хотя бы один токен всегда остаётся модели, чтобы получить логиты
+            limit = len(token_ids) - 1
+            while node is not None and depth < limit:
+                child = node['children'].get(token_ids[depth])
+                if child is None:
+                    break
+                node = child
+                depth += 1
+            
+            if node is None or depth == 0:
+                return None, 0
+            
+            # Любой потомок узла хранит KV, начинающийся с того же префикса
+            holder = node
+            while holder['kv'] is None:
+                holder = next(iter(holder['children'].values()))
+            self.entries.move_to_end(id(holder))
+            
+            self.hits += 1
+            self.reused_tokens += depth
+            return self.copy_kv(holder['kv'], depth), depth
+    
+    def insert(self, namespace, token_ids, kv):
+        """Сохраняет KV для префикса token_ids (kv должен быть собственной копией)"""
+        size_mb = self.kv_size_mb(kv)
+        if not token_ids or size_mb > self.budget_mb:
+            return
+        
+        with self.lock:
+            node = self.root['children'].get(namespace)
+            if node is None:
+                node = {'key': namespace, 'parent': self.root, 'children': {}, 'kv': None, 'size_mb': 0}
+                self.root['children'][namespace] = node
+            
+            for token in token_ids:
+                child = node['children'].get(token)
+                if child is None:
+                    child = {'key': token, 'parent': node, 'children': {}, 'kv': None, 'size_mb': 0}
+                    node['children'][token] = child
+                elif child['kv'] is not None:
+                    # Более короткий префикс теперь восстанавливается обрезкой нового
+                    self._drop(child, prune=False)
+                node = child
+            
+            if node['kv'] is not None:
+                self._drop(node, prune=False)
+            node['kv'] = kv
+            node['size_mb'] = size_mb
+            self.entries[id(node)] = node
+            self.total_mb += size_mb
+            
+            while self.total_mb > self.budget_mb and len(self.entries) > 1:
+                oldest = next(iter(self.entries.values()))
+                self._drop(oldest)
+    
+    def _drop(self, node, prune=True):
+        self.entries.pop(id(node), None)
+        self.total_mb -= node['size_mb']
+        node['kv'] = None
+        node['size_mb'] = 0
+        
+        while prune and node['parent'] is not None and node['kv'] is None and not node['children']:
+            node['parent']['children'].pop(node['key'], None)
+            node = node['parent']
+    
+    def clear(self):
+        with self.lock:
+            self.root = {'key': None, 'parent': None, 'children': {}, 'kv': None, 'size_mb': 0}
+            self.entries = OrderedDict()
+            self.total_mb = 0
+    
+    def get_stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'size_mb': self.total_mb,
+                'budget_mb': self.budget_mb,
+                'lookups': self.lookups,
+                'hits': self.hits,
+                'hit_rate': self.hits / self.lookups if self.lookups else 0.0,
+                'token_hit_rate': self.reused_tokens / self.total_tokens if self.total_tokens else 0.0
+            }
+
+class NeuroshiftEngine:
+    """Кэш KV-состояний фрагментов базы знаний: каждый фрагмент кодируется один раз,
+    сохраняется на диск и при запросе склеивается с остальными без повторного prefill"""
+    HEADER = "Based on this knowledge:\n"
+    
+    def __init__(self, cache_dir, memory_mb=256, disk_mb=1024):
+        self.cache_dir = cache_dir
+        self.memory_mb = memory_mb
+        self.disk_mb = disk_mb
+        self.memory = OrderedDict()
+        self.memory_total_mb = 0
+        self.headers = {}
+        self.lock = threading.RLock()
+        self.precompute_running = False
+        self.disk_total_mb = None
+    
+    @staticmethod
+    def format_passage(item):
+        """Форматирует запись базы знаний так же, как она вставляется в промпт"""
+        parts = []
+        if item.get('english'):
+            parts.append(f"Russian: {item['russian']}")
+            parts.append(f"English: {item['english']}")
+        else:
+            parts.append(f"Text: {item['russian']}")
+        if item.get('context'):
+            parts.append(f"Context: {item['context']}")
+        return "\n".join(parts)
+    
+    @staticmethod
+    def question_segment(question):
+        return f"\nQuestion: {question}\nAnswer in English:"
+    
+    @staticmethod
+    def model_variant(model_name, model):
+        """Имя варианта модели для ключей кэша: KV в другой точности или другой ревизии весов несовместим"""
+        dtype = str(getattr(model, 'dtype', 'float32')).replace('torch.', '')
+        revision = getattr(getattr(model, 'config', None), '_commit_hash', None)
+        return f"{model_name}-{dtype}" + (f"-{revision[:8]}" if isinstance(revision, str) else "")
+    
+    def _model_dir(self, variant):
+        path = os.path.join(self.cache_dir, variant)
+        if not os.path.exists(path):
+            os.makedirs(path)
+        return path
+    
+    def _disk_usage_mb(self):
+        if self.disk_total_mb is None:
+            total = 0
+            for dirpath, _, filenames in os.walk(self.cache_dir):
+                for filename in filenames:
+                    total += os.path.getsize(os.path.join(dirpath, filename))
+            self.disk_total_mb = total / (1024 * 1024)
+        return self.disk_total_mb
+    
+    def _remember(self, key, state):
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                return
+            self.memory[key] = state
+            self.memory_total_mb += state['size_mb']
+            while self.memory_total_mb > self.memory_mb and len(self.memory) > 1:
+                _, old_state = self.memory.popitem(last=False)
+                self.memory_total_mb -= old_state['size_mb']
+    
+    def clear_memory(self):
+        """Сбрасывает состояния в памяти; файлы на диске разделены по вариантам модели и остаются"""
+        with self.lock:
+            self.memory.clear()
+            self.memory_total_mb = 0
+            self.headers.clear()
+    
+    def header_state(self, model_name, tokenizer, model, device):
+        """KV-состояние общего заголовка промпта (позиции с нуля)"""
+        variant = self.model_variant(model_name, model)
+        with self.lock:
+            state = self.headers.get(variant)
+        if state is not None:
+            return state
+        
+        ids = tokenizer.encode(self.HEADER)
+        with torch.no_grad():
+            outputs = model(torch.tensor([ids], device=device), use_cache=True)
+        state = {'ids': ids, 'layers': PrefixCache.kv_layers(outputs.past_key_values),
+                 'legacy': isinstance(outputs.past_key_values, (tuple, list))}
+        with self.lock:
+            self.headers[variant] = state
+        return state
+    
+    def passage_state(self, model_name, tokenizer, model, device, text, offset):
+        """KV-состояние фрагмента, посчитанное с позиций offset поверх заголовка.
+        
+        У GPT-1/GPT-2 абсолютные позиционные эмбеддинги, поэтому готовый KV нельзя
+        сдвинуть на другую позицию: состояние кэшируется отдельно для каждого смещения.
+        """
+        variant = self.model_variant(model_name, model)
+        key = hashlib.sha1(f"{variant}|{offset}|{text}".encode('utf-8')).hexdigest()
+        with self.lock:
+            state = self.memory.get(key)
+            if state is not None:
+                self.memory.move_to_end(key)
+                return state
+        
+        path = os.path.join(self._model_dir(variant), f"{key}.pt")
+        if os.path.exists(path):
+            try:
+                saved = torch.load(path, map_location=device)
+                dtype = getattr(model, 'dtype', None)
+                layers = [(keys.to(dtype), values.to(dtype)) if dtype is not None else (keys, values)
+                          for keys, values in saved['layers']]
+                state = {'ids': saved['ids'], 'layers': layers,
+                         'size_mb': PrefixCache.kv_size_mb(layers)}
+                self._remember(key, state)
+                return state
+            except Exception as e:
+                print(f"Ошибка чтения кэша Neuroshift {path}: {e}")
+        
+        header = self.header_state(model_name, tokenizer, model, device)
+        header_length = len(header['ids'])
+        ids = tokenizer.encode(text + "\n")
+        # Фрагмент видит только заголовок, но стоит на своих реальных позициях в промпте
+        past_key_values = PrefixCache.make_kv(header['layers'], header['legacy'])
+        position_ids = torch.arange(offset, offset + len(ids), device=device).unsqueeze(0)
+        with torch.no_grad():
+            outputs = model(torch.tensor([ids], device=device),
+                            past_key_values=past_key_values,
+                            position_ids=position_ids,
+                            use_cache=True)
+        layers = [(keys[:, :, header_length:, :].contiguous(), values[:, :, header_length:, :].contiguous())
+                  for keys, values in PrefixCache.kv_layers(outputs.past_key_values)]
+        state = {'ids': ids, 'layers': layers, 'size_mb': PrefixCache.kv_size_mb(layers)}
+        self._remember(key, state)
+        
+        if self._disk_usage_mb() + state['size_mb'] <= self.disk_mb:
+            try:
+                torch.save({'ids': ids, 'layers': [(k.cpu(), v.cpu()) for k, v in layers]}, path)
+                self.disk_total_mb += state['size_mb']
+            except Exception as e:
+                print(f"Ошибка сохранения кэша Neuroshift {path}: {e}")
+        return state
+    
+    def build_context(self, model_name, tokenizer, model, device, items, question, chunk_size=0):
+        """Склеивает KV заголовка и фрагментов, досчитывает только токены вопроса.
+        
+        Возвращает input_ids всего промпта и KV-кэш для всех токенов, кроме последнего.
+        """
+        header = self.header_state(model_name, tokenizer, model, device)
+        ids = list(header['ids'])
+        key_parts = [[keys] for keys, _ in header['layers']]
+        value_parts = [[values] for _, values in header['layers']]
+        
+        for item in items:
+            state = self.passage_state(model_name, tokenizer, model, device,
+                                       self.format_passage(item), len(ids))
+            ids.extend(state['ids'])
+            for layer_idx, (keys, values) in enumerate(state['layers']):
+                key_parts[layer_idx].append(keys)
+                value_parts[layer_idx].append(values)
+        
+        context_length = len(ids)
+        ids.extend(tokenizer.encode(self.question_segment(question)))
+        past_key_values = PrefixCache.make_kv(
+            [(torch.cat(keys, dim=2), torch.cat(values, dim=2)) for keys, values in zip(key_parts, value_parts)],
+            header['legacy'])
+        
+        input_ids = torch.tensor([ids], device=device)
+        if len(ids) - 1 > context_length:
+            past_key_values = prefill_in_chunks(model, input_ids, past_key_values,
+                                                context_length, len(ids) - 1, chunk_size)
+        
+        print(f"Neuroshift: из кэша {context_length} токенов, досчитано {len(ids) - context_length}")
+        return input_ids, past_key_values
+    
+    def precompute(self, model_name, tokenizer, model, device, items):
+        """Фоново кодирует фрагменты базы знаний для первой позиции после заголовка"""
+        with self.lock:
+            if self.precompute_running:
+                return
+            self.precompute_running = True
+        
+        try:
+            header = self.header_state(model_name, tokenizer, model, device)
+            computed = 0
+            for item in items:
+                if self._disk_usage_mb() >= self.disk_mb:
+                    print("Neuroshift: достигнут лимит кэша на диске")
+                    break
+                self.passage_state(model_name, tokenizer, model, device,
+                                   self.format_passage(item), len(header['ids']))
+                computed += 1
+                time.sleep(0.01)
+            print(f"Neuroshift: подготовлено {computed} фрагментов базы знаний")
+        except Exception as e:
+            print(f"Ошибка подготовки кэша Neuroshift: {e}")
+        finally:
+            self.precompute_running = False
+
+class InferenceEngine:
+    """Модели, база знаний и конвейер генерации без привязки к интерфейсу.
+    
+    Окно приложения использует его напрямую, локальный сервер (--serve) — для всех клиентов.
+    """
+    CONFIG_DEFAULTS = {
+        'model_pool_budget_mb': 2048,
+        'compile_model': False,
+        'torch_threads': None,
+        'torch_interop_threads': None,
+        'prefix_cache_mb': 256,
+        'neuroshift_cache_mb': 256,
+        'neuroshift_disk_mb': 1024,
+        'stop_strings': ["Question:", "Answer in English:"],
+        'low_memory_loading': True,
+        'weights_dtype': "float32",
+        'prefill_chunk_tokens': 64,
+        'answer_cache_threshold': 0.9,
+        'answer_cache_entries': 1000,
+        'translator_backend': None,
+        'translation_timeout_s': 5.0,
+        'translation_slow_s': 3.0,
+        'translation_max_failures': 3,
+        'translation_cooldown_s': 60.0,
+        'translation_load_timeout_s': 60.0
+    }
+    # Настройки, от которых зависят загруженные веса: после их изменения модели перегружаются
+    RELOAD_KEYS = ('compile_model', 'low_memory_loading', 'weights_dtype')
+    PRETRANSLATION_BATCH = 16
+    
+    def __init__(self, data_dir, config=None):
+        self.data_dir = data_dir
+        self.education_dir = os.path.join(data_dir, "education")
+        
+        config = config or {}
+        for key, default in self.CONFIG_DEFAULTS.items():
+            setattr(self, key, copy.deepcopy(config.get(key, default)))
+        
+        self.translation_breaker = CircuitBreaker(self.translation_timeout_s, self.translation_slow_s,
+                                                  self.translation_max_failures, self.translation_cooldown_s,
+                                                  self.translation_load_timeout_s)
+        # У фонового перевода свой предохранитель с таймаутом на всю пачку и одним потоком:
+        # его сбои и зависания не размыкают цепь, через которую переводятся запросы
+        self.pretranslation_breaker = CircuitBreaker(
+            self.translation_timeout_s * self.PRETRANSLATION_BATCH,
+            self.translation_slow_s * self.PRETRANSLATION_BATCH,
+            self.translation_max_failures, self.translation_cooldown_s,
+            self.translation_load_timeout_s, max_workers=1)
+        self.translator_backend = set_translator_backend(self.translator_backend, self.translation_breaker)
+        self.knowledge_base = KnowledgeBase(self.education_dir)
+        self.model_pool = ModelPool(self.model_pool_budget_mb)
+        self.prefix_cache = PrefixCache(self.prefix_cache_mb)
+        self.neuroshift = NeuroshiftEngine(os.path.join(data_dir, "cache", "neuroshift"),
+                                           self.neuroshift_cache_mb, self.neuroshift_disk_mb)
+        self.model_backends = {}
+        self.interop_threads_applied = False
+        self.metrics = MetricsRecorder(os.path.join(data_dir, "logs", "metrics.jsonl"))
+        self.active_requests = 0
+        self.requests_changed = threading.Condition()
+        self.pretranslation_running = False
+        self.answer_cache = AnswerCache(os.path.join(data_dir, "cache", "answers.json"),
+                                        self.answer_cache_entries)
+        self.profile_next = False
+    
+    def get_config(self):
+        return {key: getattr(self, key) for key in self.CONFIG_DEFAULTS}
+    
+    def update_config(self, changes):
+        """Применяет изменённые настройки; возвращает True, если модели выгружены для перезагрузки"""
+        changes = {key: value for key, value in changes.items() if key in self.CONFIG_DEFAULTS}
+        reload = any(key in self.RELOAD_KEYS and getattr(self, key) != value
+                     for key, value in changes.items())
+        for key, value in changes.items():
+            setattr(self, key, value)
+        if 'model_pool_budget_mb' in changes:
+            self.model_pool.set_budget(self.model_pool_budget_mb)
+        if 'translator_backend' in changes:
+            self.translator_backend = set_translator_backend(self.translator_backend, self.translation_breaker)
+            self.translation_breaker.reset()
+            self.pretranslation_breaker.reset()
+        if reload:
+            self.unload_models()
+        return reload
+    
+    def unload_models(self):
+        """Выгружает модели вместе с их KV-кэшами, чтобы новые настройки загрузки вступили в силу"""
+        self.model_pool.clear()
+        self.prefix_cache.clear()
+        self.neuroshift.clear_memory()
+    
+    def close(self):
+        """Сохраняет отложенные записи кэша ответов"""
+        self.answer_cache.close()
+    
+    def get_model(self, model_name, warmup=False):
+        """Возвращает запись пула для модели, при необходимости загружая её (блокирующий вызов)"""
+        if not TRANSFORMERS_AVAILABLE:
+            raise RuntimeError("Установите библиотеки transformers и torch")
+        
+        self.apply_thread_settings()
+        entry = self.model_pool.load(model_name, self.load_model_weights)
+        if warmup and not entry.get('warmed'):
+            self.warmup_model(entry['tokenizer'], entry['model'], entry['device'])
+            entry['warmed'] = True
+        return entry
+    
+    def preload(self, model_name):
+        return TRANSFORMERS_AVAILABLE and self.model_pool.preload(model_name, self.load_model_weights)
+    
+    def activate(self, model_name, precompute=True):
+        """Делает модель активной: защищает её от вытеснения и готовит кэш Neuroshift"""
+        self.model_pool.pin(model_name)
+        if precompute:
+            self.start_neuroshift_precompute(model_name)
+    
+    def describe_model(self, model_name):
+        device_type = "GPU" if TRANSFORMERS_AVAILABLE and torch.cuda.is_available() else "CPU"
+        if self.model_backends.get(model_name) == "compiled":
+            device_type += ", compiled"
+        return device_type
+    
+    def load_model_weights(self, model_name):
+        """Загружает токенизатор и веса модели (вызывается из фонового потока)"""
+        print(f"Загрузка модели {model_name}...")
+        with MemoryMonitor() as memory:
+            if model_name == "GPT-1":
+                tokenizer = OpenAIGPTTokenizer.from_pretrained("openai-community/openai-gpt")
+                model = self._from_pretrained(OpenAIGPTLMHeadModel, "openai-community/openai-gpt")
+            else:
+                tokenizer = AutoTokenizer.from_pretrained("openai-community/gpt2")
+                model = self._from_pretrained(AutoModelForCausalLM, "openai-community/gpt2")
+                if tokenizer.pad_token is None:
+                    tokenizer.pad_token = tokenizer.eos_token
+            
+            device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+            model = model.to(device)
+        
+        if memory.peak_mb is not None:
+            print(f"Память при загрузке {model_name}: было {memory.start_mb:.0f} МБ, "
+                  f"пик {memory.peak_mb:.0f} МБ (+{memory.peak_mb - memory.start_mb:.0f} МБ), "
+                  f"веса {self.weights_dtype}, экономный режим: {'да' if self.low_memory_loading else 'нет'}")
+        
+        self.model_backends[model_name] = "eager"
+        if self.compile_model and self._compile_model(tokenizer, model, device):
+            self.model_backends[model_name] = "compiled"
+        
+        print(f"Модель {model_name} загружена успешно")
+        return tokenizer, model, device
+    
+    def _from_pretrained(self, model_class, repo_id):
+        """Загружает веса с учётом экономного режима и выбранной точности"""
+        kwargs = {}
+        if self.weights_dtype in ("bfloat16", "float16"):
+            kwargs['torch_dtype'] = getattr(torch, self.weights_dtype)
+        
+        if not self.low_memory_loading:
+            return model_class.from_pretrained(repo_id, **kwargs)
+        
+        # safetensors из локального кэша отображаются в память (mmap) без промежуточной копии
+        kwargs['low_cpu_mem_usage'] = True
+        try:
+            return model_class.from_pretrained(repo_id, local_files_only=True, **kwargs)
+        except OSError:
+            pass
+        except ImportError as e:
+            print(f"Экономная загрузка недоступна ({e}), используется обычная")
+            kwargs.pop('low_cpu_mem_usage')
+        return model_class.from_pretrained(repo_id, **kwargs)
+    
+    def _compile_model(self, tokenizer, model, device):
+        """Компилирует forward модели через torch.compile, при ошибке возвращает обычный режим"""
+        if not hasattr(torch, 'compile'):
+            print("torch.compile недоступен в этой версии torch, используется обычный режим")
+            return False
+        
+        cache_dir = os.path.join(self.data_dir, "cache", "torch_compile")
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", cache_dir)
+        try:
+            import torch._inductor.config as inductor_config
+            inductor_config.fx_graph_cache = True
+        except Exception:
+            pass
+        
+        eager_forward = model.forward
+        try:
+            print("Компиляция модели (torch.compile), первый запуск может занять минуту...")
+            start = time.time()
+            model.forward = torch.compile(eager_forward, dynamic=True)
+            if not self.warmup_model(tokenizer, model, device):
+                raise RuntimeError("прогрев скомпилированной модели не удался")
+            print(f"Модель скомпилирована за {time.time() - start:.1f} с")
+            return True
+        except Exception as e:
+            print(f"Компиляция недоступна, используется обычный режим: {e}")
+            model.forward = eager_forward
+            return False
+    
+    def warmup_model(self, tokenizer, model, device):
+        """Короткая генерация, чтобы прогреть аллокатор и ядра до первого запроса"""
+        try:
+            start = time.time()
+            input_ids = tokenizer.encode("Hello, how are you?", return_tensors="pt").to(device)
+            with torch.no_grad():
+                model.generate(
+                    input_ids,
+                    max_new_tokens=8,
+                    do_sample=True,
+                    temperature=0.7,
+                    top_p=0.9,
+                    repetition_penalty=1.1,
+                    pad_token_id=getattr(tokenizer, 'pad_token_id', None),
+                    eos_token_id=getattr(tokenizer, 'eos_token_id', None)
+                )
+            print(f"Прогрев модели завершён за {time.time() - start:.2f} с")
+            return True
+        except Exception as e:
+            print(f"Ошибка прогрева модели: {e}")
+            return False
+    
+    def apply_thread_settings(self):
+        """Применяет сохранённое число потоков torch"""
+        if self.torch_threads:
+            torch.set_num_threads(self.torch_threads)
+        
+        if self.torch_interop_threads and not self.interop_threads_applied:
+            try:
+                torch.set_num_interop_threads(self.torch_interop_threads)
+            except RuntimeError as e:
+                print(f"Не удалось задать inter-op потоки: {e}")
+            self.interop_threads_applied = True
+    
+    def calibrate_threads(self, model_name):
+        """Замеряет скорость генерации при разном числе потоков и запоминает лучшее.
+        
+        Возвращает лучшее число потоков и словарь {потоки: токенов/с}.
+        """
+        entry = self.get_model(model_name)
+        tokenizer, model, device = entry['tokenizer'], entry['model'], entry['device']
+        
+        cores = os.cpu_count() or 1
+        candidates = {1, cores, max(1, cores - 1)}
+        count = 2
+        while count < cores:
+            candidates.add(count)
+            count *= 2
+        
+        input_ids = tokenizer.encode("The quick brown fox jumps over the lazy dog.",
+                                     return_tensors="pt").to(device)
+        new_tokens = 32
+        
+        def measure():
+            start = time.time()
+            with torch.no_grad():
+                output = model.generate(
+                    input_ids,
+                    max_new_tokens=new_tokens,
+                    min_new_tokens=new_tokens,
+                    do_sample=False,
+                    pad_token_id=getattr(tokenizer, 'pad_token_id', None)
+                )
+            generated = output.shape[-1] - input_ids.shape[-1]
+            return generated / max(time.time() - start, 1e-6)
+        
+        previous = torch.get_num_threads()
+        measure()
+        results = {}
+        for threads in sorted(candidates):
+            torch.set_num_threads(threads)
+            results[threads] = measure()
+            print(f"Калибровка: {threads} потоков — {results[threads]:.1f} токенов/с")
+        torch.set_num_threads(previous)
+        
+        best = max(results, key=results.get)
+        self.torch_threads = best
+        if self.torch_interop_threads is None:
+            self.torch_interop_threads = 1 if best <= 2 else 2
+        self.apply_thread_settings()
+        return best, results
+    
+    def start_neuroshift_precompute(self, model_name):
+        """Запускает фоновую подготовку KV-кэша фрагментов базы знаний"""
+        entry = self.model_pool.get(model_name)
+        if not entry or not self.supports_kv_cache(entry['model']):
+            return
+        
+        threading.Thread(target=self.neuroshift.precompute,
+                         args=(model_name, entry['tokenizer'], entry['model'],
+                               entry['device'], list(self.knowledge_base.data)),
+                         daemon=True).start()
+    
+    def reload_knowledge(self):
+        """Перечитывает базу знаний и обновляет кэш Neuroshift активной модели"""
+        self.knowledge_base.load_data()
+        self.start_pretranslation()
+        if self.model_pool.pinned:
+            self.start_neuroshift_precompute(self.model_pool.pinned)
+    
+    def start_pretranslation(self):
+        """Фоново переводит на английский записи свободного текста без перевода.
+        
+        Работает с низким приоритетом: небольшими пачками и только пока нет активных запросов.
+        Пропущенные из-за сбоев пачки переводятся повторным запуском после паузы предохранителя.
+        """
+        if self.pretranslation_running or not TRANSLATOR_AVAILABLE:
+            return
+        texts = self.knowledge_base.missing_translations()
+        if not texts:
+            return
+        self.pretranslation_running = True
+        
+        def pretranslate():
+            translated = 0
+            skipped = 0
+            batch_size = self.PRETRANSLATION_BATCH
+            options = {'breaker': self.pretranslation_breaker} if isinstance(translator, CachedTranslator) else {}
+            try:
+                for start in range(0, len(texts), batch_size):
+                    self.wait_until_idle()
+                    self.pretranslation_breaker.wait_until_available()
+                    batch = texts[start:start + batch_size]
+                    try:
+                        results = translator.translate_batch(batch, dest='en', src='ru', **options)
+                    except TranslationUnavailable as e:
+                        print(f"Пачка фонового перевода отложена: {e}")
+                        results = e.partial or [None] * len(batch)
+                    except Exception as e:
+                        print(f"Пачка фонового перевода отложена: {e}")
+                        results = [None] * len(batch)
+                    done = [(text, result) for text, result in zip(batch, results) if result is not None]
+                    self.knowledge_base.set_translations({
+                        text: result.text for text, result in done
+                        if result.text and result.text != text
+                    })
+                    translated += len(done)
+                    skipped += len(batch) - len(done)
+                    time.sleep(0.1)
+                print(f"Переведено записей базы знаний: {translated}")
+            except Exception as e:
+                print(f"Ошибка фонового перевода базы знаний: {e}")
+            finally:
+                self.pretranslation_running = False
+            
+            if skipped:
+                print(f"Записей отложено до повторного запуска: {skipped}")
+                retry = threading.Timer(self.pretranslation_breaker.cooldown, self.start_pretranslation)
+                retry.daemon = True
+                retry.start()
+            
+            # Фрагменты с переводом выглядят в промпте иначе, кэш Neuroshift готовится заново
+            if translated and self.model_pool.pinned:
+                self.start_neuroshift_precompute(self.model_pool.pinned)
+        
+        threading.Thread(target=pretranslate, daemon=True).start()
+    
+    def translate(self, text, dest, src='auto'):
+        """Переводит текст с таймаутом; при сбое или разомкнутой цепи возвращает его как есть"""
+        if not TRANSLATOR_AVAILABLE:
+            return text
+        try:
+            return self.translate_strict(text, dest, src)
+        except Exception as e:
+            print(f"Перевод пропущен: {e}")
+            return text
+    
+    def translate_strict(self, text, dest, src='auto'):
+        """Как translate, но при сбое бросает исключение, а не возвращает текст без перевода"""
+        if not TRANSLATOR_AVAILABLE:
+            raise TranslationUnavailable("переводчик не установлен")
+        return translator.translate(text, dest=dest, src=src).text
+    
+    def translate_segments(self, texts, dest):
+        """Переводит одной пачкой только те тексты, что написаны не в письменности dest.
+        
+        Возвращает словарь {исходный текст: перевод} для переведённых текстов.
+        """
+        pending = list(dict.fromkeys(text for text in texts if needs_translation(text, dest)))
+        if not pending or not TRANSLATOR_AVAILABLE:
+            return {}
+        try:
+            results = translator.translate_batch(pending, dest=dest)
+        except TranslationUnavailable as e:
+            # Переводы из кэша используются, даже когда переводчик недоступен
+            print(f"Перевод пропущен: {e}")
+            results = e.partial or []
+        except Exception as e:
+            print(f"Перевод пропущен: {e}")
+            return {}
+        return {text: result.text for text, result in zip(pending, results) if result is not None}
+    
+    @contextmanager
+    def active_request(self):
+        """Отмечает запрос как активный, пока он идёт фоновые задачи уступают ему"""
+        with self.requests_changed:
+            self.active_requests += 1
+        try:
+            yield
+        finally:
+            with self.requests_changed:
+                self.active_requests -= 1
+                self.requests_changed.notify_all()
+    
+    def wait_until_idle(self, timeout=None):
+        """Ждёт, пока не останется активных запросов; возвращает False по таймауту"""
+        with self.requests_changed:
+            return self.requests_changed.wait_for(lambda: self.active_requests == 0, timeout)
+    
+    def retrieve(self, query, threshold=0.3, limit=None):
+        """Ищет похожие записи в базе знаний"""
+        results = self.knowledge_base.find_similar(query, threshold=threshold)
+        return results[:limit] if limit else results
+    
+    def trim_at_stop(self, text, start=0):
+        """Обрезает текст по первой стоп-строке, найденной после позиции start"""
+        cut = len(text)
+        for stop in self.stop_strings:
+            if not stop:
+                continue
+            index = text.find(stop, start)
+            if index != -1:
+                cut = min(cut, index)
+        return text[:cut]
+    
+    @staticmethod
+    def supports_kv_cache(model):
+        """Проверяет, умеет ли модель работать с KV-кэшем (GPT-1 не умеет)"""
+        try:
+            return 'past_key_values' in inspect.signature(model.forward).parameters
+        except (TypeError, ValueError):
+            return False
+    
+    def supports_prompt_lookup(self, model):
+        return PROMPT_LOOKUP_AVAILABLE and self.supports_kv_cache(model)
+    
+    def prefill_prompt(self, model_name, model, input_ids):
+        """Считает KV-кэш промпта, продолжая с самого длинного закешированного префикса"""
+        if not self.supports_kv_cache(model):
+            return None
+        
+        token_ids = input_ids[0].tolist()
+        # Последний токен промпта обрабатывает generate, чтобы получить первые логиты
+        prompt_length = len(token_ids) - 1
+        if prompt_length <= 0:
+            return None
+        
+        past_key_values, cached_length = self.prefix_cache.lookup(model_name, token_ids)
+        if cached_length < prompt_length:
+            past_key_values = prefill_in_chunks(model, input_ids, past_key_values,
+                                                cached_length, prompt_length, self.prefill_chunk_tokens)
+        
+        self.prefix_cache.insert(model_name, token_ids[:prompt_length],
+                                 PrefixCache.copy_kv(past_key_values, prompt_length))
+        print(f"Префиксный кэш: переиспользовано {cached_length}/{len(token_ids)} токенов")
+        return past_key_values
+    
+    def profile_next_request(self):
+        """Включает профилирование следующего запроса чата или помощника"""
+        self.profile_next = True
+    
+    def request_profiler(self, kind):
+        if not self.profile_next:
+            return nullcontext()
+        self.profile_next = False
+        return RequestProfiler(os.path.join(self.data_dir, "logs"), kind)
+    
+    def generate_chat(self, model_name, message, max_new_tokens=100, temperature=0.7,
+                      cancel_event=None, streamer=None):
+        """Продолжает текст сообщения выбранной моделью (режим чата)"""
+        with self.active_request(), self.request_profiler('chat'):
+            return self._generate_chat(model_name, message, max_new_tokens, temperature,
+                                       cancel_event, streamer)
+    
+    def _generate_chat(self, model_name, message, max_new_tokens, temperature, cancel_event, streamer):
+        entry = self.get_model(model_name)
+        tokenizer, model, device = entry['tokenizer'], entry['model'], entry['device']
+        timer = StageTimer()
+        
+        with timer.stage('tokenize'):
+            input_ids = tokenizer.encode(message, return_tensors="pt").to(device)
+        stopping_criteria = StoppingCriteriaList([
+            GenerationStopper(tokenizer, input_ids.shape[-1], self.stop_strings, cancel_event)
+        ])
+        
+        with timer.stage('generate'), MemoryMonitor() as generate_memory, torch.no_grad():
+            if model_name == "GPT-1":
+                output = model.generate(
+                    input_ids,
+                    max_new_tokens=max_new_tokens,
+                    do_sample=True,
+                    temperature=temperature,
+                    top_p=0.9,
+                    repetition_penalty=1.1,
+                    stopping_criteria=stopping_criteria,
+                    streamer=streamer
+                )
+            else:
+                output = model.generate(
+                    input_ids,
+                    max_new_tokens=max_new_tokens,
+                    temperature=temperature,
+                    do_sample=True,
+                    top_p=0.9,
+                    repetition_penalty=1.1,
+                    no_repeat_ngram_size=2,
+                    pad_token_id=tokenizer.pad_token_id,
+                    eos_token_id=tokenizer.eos_token_id,
+                    stopping_criteria=stopping_criteria,
+                    streamer=streamer
+                )
+        
+        with timer.stage('decode'):
+            generated_text = tokenizer.decode(output[0], skip_special_tokens=True)
+            prompt_text = tokenizer.decode(output[0][:input_ids.shape[-1]], skip_special_tokens=True)
+        stop_search_start = len(prompt_text) if generated_text.startswith(prompt_text) else 0
+        generated_text = self.trim_at_stop(generated_text, stop_search_start).rstrip()
+        
+        if model_name == "GPT-2" and generated_text.startswith(message):
+            generated_text = generated_text[len(message):].strip()
+        
+        self.metrics.record('chat', model_name, timer.timings,
+                            input_ids.shape[-1], output.shape[-1] - input_ids.shape[-1],
+                            self.memory_metrics(generate=generate_memory))
+        return generated_text
+    
+    def answer_question(self, model_name, question, settings, cancel_event=None, on_sentence=None):
+        """Отвечает на вопрос с опорой на базу знаний (режим помощника).
+        
+        Возвращает словарь с русским и английским ответом, числом найденных записей,
+        числом токенов и временем каждого этапа. Если передан on_sentence, он получает
+        переведённые предложения ответа ещё во время генерации.
+        """
+        with self.active_request(), self.request_profiler('assistant'):
+            use_cache = settings.get('answer_cache', True)
+            if use_cache:
+                timer = StageTimer()
+                with timer.stage('answer_cache'):
+                    cache_key = AnswerCache.make_key(
+                        model_name, settings, self.knowledge_base.get_version(),
+                        stop_strings=self.stop_strings, translator=self.translator_backend,
+                        sentence_translation=on_sentence is not None, weights_dtype=self.weights_dtype)
+                    cached = self.answer_cache.lookup(cache_key, question, self.answer_cache_threshold)
+                if cached:
+                    # Поиск, переводы и генерация пропускаются целиком
+                    metrics = self.metrics.record('assistant', model_name, timer.timings, 0, 0)
+                    cached.update(cached=True, timings=metrics['timings'], tokens_per_s=0.0, new_tokens=0)
+                    if on_sentence:
+                        on_sentence(cached['answer'])
+                    return cached
+            
+            result = self._answer_question(model_name, question, settings, cancel_event, on_sentence)
+            
+            if (use_cache and result['english'] and result['back_translated']
+                    and not (cancel_event and cancel_event.is_set())):
+                self.answer_cache.store(cache_key, question, {
+                    key: result[key] for key in ('answer', 'english', 'knowledge_count')
+                })
+            return result
+    
+    def _answer_question(self, model_name, question, settings, cancel_event, on_sentence):
+        entry = self.get_model(model_name)
+        tokenizer, model, device = entry['tokenizer'], entry['model'], entry['device']
+        timer = StageTimer()
+        
+        with timer.stage('find_similar'):
+            similar_results = self.knowledge_base.find_similar(question, threshold=0.3)
+        knowledge_items = [result['item'] for result in similar_results[:3]]
+        
+        # Переводятся только вопрос и записи без английского текста, одной пачкой
+        with timer.stage('translate_in'):
+            pending = [question] + [item['russian'] for item in knowledge_items if not item['english']]
+            translated = self.translate_segments(pending, 'en')
+        english_question = translated.get(question, question)
+        knowledge_items = [item if item['english'] or item['russian'] not in translated
+                           else dict(item, english=translated[item['russian']])
+                           for item in knowledge_items]
+        
+        use_neuroshift = (settings.get('neuroshift', True) and knowledge_items
+                          and self.supports_kv_cache(model))
+        
+        if use_neuroshift:
+            # Фрагменты базы знаний берутся из кэша Neuroshift, досчитывается только вопрос
+            with timer.stage('prefill'), MemoryMonitor() as prefill_memory:
+                input_ids, past_key_values = self.neuroshift.build_context(
+                    model_name, tokenizer, model, device, knowledge_items, english_question,
+                    self.prefill_chunk_tokens)
+        else:
+            if knowledge_items:
+                context_text = "\n".join(NeuroshiftEngine.format_passage(item) for item in knowledge_items)
+                english_prompt = f"{NeuroshiftEngine.HEADER}{context_text}\n{NeuroshiftEngine.question_segment(english_question)}"
+            else:
+                english_prompt = f"Question: {english_question}\nAnswer in English:"
+            
+            with timer.stage('tokenize'):
+                input_ids = tokenizer.encode(english_prompt, return_tensors="pt").to(device)
+            with timer.stage('prefill'), MemoryMonitor() as prefill_memory:
+                past_key_values = self.prefill_prompt(model_name, model, input_ids)
+        
+        generation_kwargs = {}
+        if settings.get('prompt_lookup', True) and self.supports_prompt_lookup(model):
+            # Черновые токены берутся n-граммами из промпта (фрагменты базы знаний)
+            # и проверяются моделью за один проход
+            generation_kwargs['prompt_lookup_num_tokens'] = settings.get('prompt_lookup_tokens', 10)
+        
+        if past_key_values is not None:
+            generation_kwargs['past_key_values'] = past_key_values
+        
+        stopper = GenerationStopper(tokenizer, input_ids.shape[-1], self.stop_strings, cancel_event)
+        
+        pipeline = None
+        if on_sentence:
+            # Готовые предложения переводятся параллельно с генерацией следующих
+            pipeline = SentenceTranslationPipeline(
+                lambda sentence: (self.translate_strict(sentence, 'ru') if needs_translation(sentence, 'ru')
+                                  else sentence),
+                on_sentence, self.stop_strings)
+            generation_kwargs['streamer'] = CallbackStreamer(tokenizer, pipeline.feed)
+        
+        with timer.stage('generate'), MemoryMonitor() as generate_memory, torch.no_grad():
+            output = model.generate(
+                input_ids,
+                max_new_tokens=settings.get('response_length', 100),
+                temperature=settings.get('temperature', 0.7),
+                do_sample=True,
+                top_p=0.9,
+                repetition_penalty=1.1,
+                pad_token_id=tokenizer.pad_token_id if hasattr(tokenizer, 'pad_token_id') else None,
+                eos_token_id=tokenizer.eos_token_id if hasattr(tokenizer, 'eos_token_id') else None,
+                stopping_criteria=StoppingCriteriaList([stopper]),
+                **generation_kwargs
+            )
+        
+        with timer.stage('decode'):
+            english_response = tokenizer.decode(output[0][input_ids.shape[-1]:], skip_special_tokens=True)
+        english_response = self.trim_at_stop(english_response).strip()
+        
+        russian_response = english_response
+        # Ответ, оставшийся без перевода из-за сбоя переводчика, не должен попасть в кэш ответов
+        back_translated = True
+        if pipeline:
+            # Остаётся дождаться перевода последних предложений
+            with timer.stage('translate_out'):
+                russian_response = pipeline.finish() or english_response
+            back_translated = not pipeline.failed
+        elif needs_translation(english_response, 'ru'):
+            with timer.stage('translate_out'):
+                try:
+                    russian_response = self.translate_strict(english_response, 'ru')
+                except Exception as e:
+                    print(f"Перевод пропущен: {e}")
+                    back_translated = False
+        
+        prompt_tokens = input_ids.shape[-1]
+        new_tokens = output.shape[-1] - input_ids.shape[-1]
+        metrics = self.metrics.record('assistant', model_name, timer.timings, prompt_tokens, new_tokens,
+                                      self.memory_metrics(prefill=prefill_memory, generate=generate_memory))
+        
+        return {
+            'answer': russian_response,
+            'english': english_response,
+            'knowledge_count': len(similar_results),
+            'prompt_tokens': prompt_tokens,
+            'new_tokens': new_tokens,
+            'timings': metrics['timings'],
+            'tokens_per_s': metrics['tokens_per_s'],
+            'memory': metrics['memory'],
+            'translator': self.translation_breaker.get_state(),
+            'back_translated': back_translated
+        }
+    
+    @staticmethod
+    def memory_metrics(**monitors):
+        """Прирост RSS за каждый этап и общий пик процесса в МБ"""
+        memory = {}
+        peaks = []
+        for stage, monitor in monitors.items():
+            if monitor.peak_mb is None:
+                continue
+            memory[f"{stage}_peak_delta_mb"] = round(monitor.peak_mb - monitor.start_mb, 1)
+            peaks.append(monitor.peak_mb)
+        if peaks:
+            memory['peak_rss_mb'] = round(max(peaks), 1)
+        return memory
+    
+    def get_stats(self):
+        return {
+            'resident_models': list(self.model_pool.entries),
+            'pool_mb': self.model_pool.total_mb(),
+            'prefix_cache': self.prefix_cache.get_stats(),
+            'translator': self.translation_breaker.get_state()
+        }
+
+class InferenceRequestHandler(BaseHTTPRequestHandler):
+    """Обработчик HTTP API локального сервера инференса"""
+    protocol_version = "HTTP/1.1"
+    
+    def log_message(self, format, *args):
+        print(f"[server] {self.address_string()} {format % args}")
+    
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length', 0))
+        if not length:
+            return {}
+        return json.loads(self.rfile.read(length).decode('utf-8'))
+    
+    def _send_json(self, data, status=200):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def do_GET(self):
+        if self.path == '/health':
+            self._send_json({'status': 'ok', **self.server.engine.get_stats()})
+        else:
+            self._send_json({'error': 'not found'}, 404)
+    
+    def do_POST(self):
+        engine = self.server.engine
+        try:
+            payload = self._read_json()
+            model_name = payload.get('model', 'GPT-2')
+            
+            if self.path == '/load':
+                engine.get_model(model_name, warmup=payload.get('warmup', False))
+                engine.activate(model_name)
+                self._send_json({'model': model_name, 'device': engine.describe_model(model_name)})
+            elif self.path == '/generate':
+                text = engine.generate_chat(model_name, payload['prompt'],
+                                            payload.get('max_new_tokens', 100),
+                                            payload.get('temperature', 0.7))
+                self._send_json({'text': text})
+            elif self.path == '/answer':
+                self._send_json(engine.answer_question(model_name, payload['question'],
+                                                       payload.get('settings', {})))
+            elif self.path == '/stream':
+                self._stream(engine, model_name, payload)
+            elif self.path == '/retrieve':
+                results = engine.retrieve(payload['query'], payload.get('threshold', 0.3),
+                                          payload.get('limit', 5))
+                self._send_json({'results': results})
+            elif self.path == '/reload':
+                engine.reload_knowledge()
+                self._send_json({'entries': len(engine.knowledge_base.data)})
+            elif self.path == '/profile':
+                engine.profile_next_request()
+                self._send_json({'armed': True})
+            elif self.path == '/calibrate':
+                best, results = engine.calibrate_threads(model_name)
+                self._send_json({'best': best, 'results': results,
+                                 'interop_threads': engine.torch_interop_threads})
+            elif self.path == '/config':
+                reloaded = engine.update_config(payload)
+                self._send_json({'reloaded': reloaded, 'config': engine.get_config()})
+            else:
+                self._send_json({'error': 'not found'}, 404)
+        except Exception as e:
+            print(f"Ошибка запроса {self.path}: {e}")
+            self._send_json({'error': str(e)}, 500)
+    
+    def _stream(self, engine, model_name, payload):
+        """Отдаёт текст по мере генерации строками JSON; разрыв соединения отменяет генерацию"""
+        chunks = queue.Queue()
+        cancel_event = threading.Event()
+        result = {}
+        
+        def run():
+            try:
+                if 'question' in payload:
+                    # В режиме помощника клиент получает уже переведённые предложения
+                    result.update(engine.answer_question(model_name, payload['question'],
+                                                         payload.get('settings', {}),
+                                                         cancel_event, chunks.put))
+                else:
+                    streamer = CallbackStreamer(engine.get_model(model_name)['tokenizer'], chunks.put)
+                    result['text'] = engine.generate_chat(model_name, payload['prompt'],
+                                                          payload.get('max_new_tokens', 100),
+                                                          payload.get('temperature', 0.7),
+                                                          cancel_event, streamer)
+            except Exception as e:
+                result['error'] = str(e)
+            finally:
+                chunks.put(None)
+        
+        worker = threading.Thread(target=run, daemon=True)
+        worker.start()
+        
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson; charset=utf-8')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        try:
+            for chunk in iter(chunks.get, None):
+                if chunk:
+                    self.wfile.write((json.dumps({'delta': chunk}, ensure_ascii=False) + "\n").encode('utf-8'))
+                    self.wfile.flush()
+            worker.join()
+            self.wfile.write((json.dumps({'done': True, **result}, ensure_ascii=False) + "\n").encode('utf-8'))
+        except (BrokenPipeError, ConnectionResetError):
+            print("[server] клиент отключился, генерация остановлена")
+            cancel_event.set()
+
+class InferenceServer(ThreadingHTTPServer):
+    """Локальный сервер инференса: одна загруженная модель на несколько окон, CLI и скриптов"""
+    daemon_threads = True
+    
+    def __init__(self, engine, host="127.0.0.1", port=8765):
+        if host not in ("127.0.0.1", "localhost", "::1"):
+            print(f"ВНИМАНИЕ: сервер слушает {host} без авторизации — модели и база знаний "
+                  f"доступны всем, кто может подключиться к порту {port}")
+        super().__init__((host, port), InferenceRequestHandler)
+        self.engine = engine
+
+class InferenceClient:
+    """Тонкий клиент локального сервера инференса с тем же интерфейсом, что у InferenceEngine"""
+    def __init__(self, url, timeout=600):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self.model_backends = {}
+    
+    def _post(self, path, payload=None):
+        request = urllib.request.Request(
+            self.url + path,
+            data=json.dumps(payload or {}, ensure_ascii=False).encode('utf-8'),
+            headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read().decode('utf-8'))
+        except urllib.error.HTTPError as e:
+            raise RuntimeError(json.loads(e.read().decode('utf-8')).get('error', str(e)))
+    
+    def _stream(self, payload, cancel_event=None, on_delta=None):
+        request = urllib.request.Request(
+            self.url + '/stream',
+            data=json.dumps(payload, ensure_ascii=False).encode('utf-8'),
+            headers={'Content-Type': 'application/json'})
+        partial = []
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            for line in response:
+                if cancel_event is not None and cancel_event.is_set():
+                    # Закрытие соединения останавливает генерацию на сервере
+                    break
+                message = json.loads(line.decode('utf-8'))
+                if message.get('done'):
+                    if message.get('error'):
+                        raise RuntimeError(message['error'])
+                    return message
+                partial.append(message['delta'])
+                if on_delta:
+                    on_delta(message['delta'])
+        text = "".join(partial).strip()
+        return {'text': text, 'answer': text, 'english': text, 'knowledge_count': 0}
+    
+    def get_model(self, model_name, warmup=False):
+        info = self._post('/load', {'model': model_name, 'warmup': warmup})
+        self.model_backends[model_name] = info.get('device', '')
+        return info
+    
+    def preload(self, model_name):
+        return False
+    
+    def activate(self, model_name, precompute=True):
+        pass
+    
+    def describe_model(self, model_name):
+        return f"server: {self.model_backends.get(model_name, '')}"
+    
+    def calibrate_threads(self, model_name):
+        """Калибрует потоки на сервере; выбранные значения запоминаются, как у InferenceEngine"""
+        data = self._post('/calibrate', {'model': model_name})
+        self.torch_threads = data['best']
+        self.torch_interop_threads = data.get('interop_threads')
+        return data['best'], {int(threads): speed for threads, speed in data['results'].items()}
+    
+    def reload_knowledge(self):
+        self._post('/reload')
+    
+    def profile_next_request(self):
+        self._post('/profile')
+    
+    def update_config(self, changes):
+        return self._post('/config', changes)['reloaded']
+    
+    def close(self):
+        """Соединение открывается на каждый запрос, закрывать нечего"""
+    
+    def get_stats(self):
+        with urllib.request.urlopen(self.url + '/health', timeout=self.timeout) as response:
+            return json.loads(response.read().decode('utf-8'))
+    
+    def retrieve(self, query, threshold=0.3, limit=None):
+        return self._post('/retrieve', {'query': query, 'threshold': threshold, 'limit': limit})['results']
+    
+    def generate_chat(self, model_name, message, max_new_tokens=100, temperature=0.7,
+                      cancel_event=None, streamer=None):
+        result = self._stream({'model': model_name, 'prompt': message,
+                               'max_new_tokens': max_new_tokens, 'temperature': temperature},
+                              cancel_event)
+        return result.get('text', '')
+    
+    def answer_question(self, model_name, question, settings, cancel_event=None, on_sentence=None):
+        result = self._stream({'model': model_name, 'question': question, 'settings': settings},
+                              cancel_event, on_sentence)
+        result.pop('done', None)
+        return result
+
 class ModernGPTLauncher:
     def __init__(self, root):
         self.root = root
@@ -247,18 +3012,25 @@ class ModernGPTLauncher:
         self.setup_colors()
         self.setup_fonts()
         
-        self.current_model = None
-        self.current_tokenizer = None
-        self.current_device = None
+        self.model_ready = False
         self.model_type = "GPT-1"
         self.language = "Русский"
         self.chats = []
         self.current_chat_id = 0
         self.chat_data = {}
+        # Сообщения открытых чатов; остальные чаты держат в памяти только метаданные
+        self.open_chats = OrderedDict()
+        self.open_chats_limit = 8
         
         self.translate_enabled = False
         self.auto_translate = False
         self.target_translate_lang = "en"
+        self.preload_on_startup = True
+        self.inference_server = ""
+        self.chat_storage = "journal"
+        self.persistence_interval = 2.0
+        self.engine_config = {}
+        self.cancel_events = {'chat': threading.Event(), 'assistant': threading.Event()}
         
         self.data_dir = os.path.join(os.path.expanduser("~"), "Documents", "TrainsFormerAI")
         self.education_dir = os.path.join(self.data_dir, "education")
@@ -270,17 +3042,34 @@ class ModernGPTLauncher:
         if not os.path.exists(self.education_dir):
             os.makedirs(self.education_dir)
         
-        self.knowledge_base = KnowledgeBase(self.education_dir)
-        
         self.assistant_settings = {
             'response_length': 100,
             'temperature': 0.7,
-            'advanced_analysis': True
+            'advanced_analysis': True,
+            'prompt_lookup': True,
+            'prompt_lookup_tokens': 10,
+            'neuroshift': True,
+            'answer_cache': True
         }
         
         self.load_config()
+        self.chat_store = open_chat_store(self.data_dir, self.chat_storage)
+        self.persistence = PersistenceWriter(self.persistence_interval)
+        self.persistence.register('config', self.write_config)
+        self.persistence.register('chats', self.write_chats_index)
         self.load_chats_data()
         
+        self.engine = InferenceEngine(self.data_dir, self.engine_config)
+        self.knowledge_base = self.engine.knowledge_base
+        # С адресом сервера окно работает как тонкий клиент, модели живут в процессе сервера
+        if self.inference_server:
+            print(f"Используется сервер инференса {self.inference_server}")
+            self.inference = InferenceClient(self.inference_server)
+        else:
+            self.inference = self.engine
+            self.engine.start_pretranslation()
+        self.inference_available = TRANSFORMERS_AVAILABLE or self.inference is not self.engine
+        
         self.assistant_chats = []
         self.current_assistant_chat_id = 0
         
@@ -296,6 +3085,7 @@ class ModernGPTLauncher:
                 "language": "Язык",
                 "input_placeholder": "Введите ваше сообщение...",
                 "send": "Отправить",
+                "stop": "Стоп",
                 "copy": "Копировать",
                 "delete": "Удалить",
                 "clear": "Очистить",
@@ -393,6 +3183,7 @@ class ModernGPTLauncher:
                 "response_length_assistant": "Длина ответа помощника:",
                 "apply": "Применить",
                 "close": "Закрыть",
+                "cached_answer": "ответ из кэша",
                 "support_boosty": "Support on Boosty",
                 "boosty_subtext": "Low cost beta tester role"
             },
@@ -405,6 +3196,7 @@ class ModernGPTLauncher:
                 "language": "Language",
                 "input_placeholder": "Type your message...",
                 "send": "Send",
+                "stop": "Stop",
                 "copy": "Copy",
                 "delete": "Delete",
                 "clear": "Clear",
@@ -502,6 +3294,7 @@ class ModernGPTLauncher:
                 "response_length_assistant": "Assistant response length:",
                 "apply": "Apply",
                 "close": "Close",
+                "cached_answer": "cached answer",
                 "support_boosty": "Support on Boosty",
                 "boosty_subtext": "Low cost beta tester role"
             }
@@ -531,8 +3324,11 @@ class ModernGPTLauncher:
             messagebox.showerror("Ошибка", f"Не удалось создать интерфейс: {e}")
             return
         
-        if TRANSFORMERS_AVAILABLE:
-            self.load_model("GPT-1")
+        if self.inference_available:
+            if self.preload_on_startup:
+                self.root.after(200, lambda: self.load_model(self.model_type, warmup=True))
+            else:
+                self.load_model("GPT-1")
         else:
             print("Библиотеки transformers/torch не установлены, используется режим тестирования")
             self.model_status = tk.Label(text="Тестовый режим (установите transformers)", fg='orange')
@@ -578,7 +3374,7 @@ class ModernGPTLauncher:
         """Открывает окно настроек помощника"""
         settings_window = tk.Toplevel(self.root)
         settings_window.title(self.language_dict[self.language]["assistant_config"])
-        settings_window.geometry("400x300")
+        settings_window.geometry("420x480")
         settings_window.configure(bg=self.theme_colors['bg'])
         settings_window.resizable(False, False)
         
@@ -641,6 +3437,52 @@ class ModernGPTLauncher:
                                       selectcolor=self.theme_colors['primary'])
         analysis_check.pack(anchor='w')
         
+        self.assistant_lookup_var = tk.BooleanVar(value=self.assistant_settings['prompt_lookup'])
+        lookup_check = tk.Checkbutton(analysis_frame, text="Ускорять ответ по тексту базы знаний",
+                                    variable=self.assistant_lookup_var,
+                                    font=self.fonts['body'],
+                                    bg=self.theme_colors['bg'],
+                                    fg=self.theme_colors['text'],
+                                    selectcolor=self.theme_colors['primary'])
+        lookup_check.pack(anchor='w')
+        
+        self.assistant_neuroshift_var = tk.BooleanVar(value=self.assistant_settings['neuroshift'])
+        neuroshift_check = tk.Checkbutton(analysis_frame, text="Neuroshift: готовый кэш фрагментов базы знаний",
+                                        variable=self.assistant_neuroshift_var,
+                                        font=self.fonts['body'],
+                                        bg=self.theme_colors['bg'],
+                                        fg=self.theme_colors['text'],
+                                        selectcolor=self.theme_colors['primary'])
+        neuroshift_check.pack(anchor='w')
+        
+        self.assistant_cache_var = tk.BooleanVar(value=self.assistant_settings['answer_cache'])
+        cache_check = tk.Checkbutton(analysis_frame, text="Отвечать из кэша на похожие вопросы",
+                                   variable=self.assistant_cache_var,
+                                   font=self.fonts['body'],
+                                   bg=self.theme_colors['bg'],
+                                   fg=self.theme_colors['text'],
+                                   selectcolor=self.theme_colors['primary'])
+        cache_check.pack(anchor='w')
+        
+        threshold_frame = tk.Frame(center_frame, bg=self.theme_colors['bg'])
+        threshold_frame.pack(fill=tk.X, pady=10)
+        
+        threshold_label = tk.Label(threshold_frame, text="Похожесть для кэша:",
+                                 font=self.fonts['body'],
+                                 bg=self.theme_colors['bg'], fg=self.theme_colors['text'])
+        threshold_label.pack(side=tk.LEFT)
+        
+        self.assistant_threshold_var = tk.DoubleVar(value=self.engine.answer_cache_threshold)
+        threshold_scale = tk.Scale(threshold_frame, from_=0.5, to=1.0,
+                                  variable=self.assistant_threshold_var,
+                                  orient=tk.HORIZONTAL,
+                                  length=200,
+                                  resolution=0.01,
+                                  bg=self.theme_colors['bg'],
+                                  fg=self.theme_colors['text'],
+                                  highlightthickness=0)
+        threshold_scale.pack(side=tk.RIGHT)
+        
         button_frame = tk.Frame(center_frame, bg=self.theme_colors['bg'])
         button_frame.pack(fill=tk.X, pady=(20, 0))
         
@@ -648,6 +3490,10 @@ class ModernGPTLauncher:
             self.assistant_settings['response_length'] = self.assistant_length_var.get()
             self.assistant_settings['temperature'] = self.assistant_temp_var.get()
             self.assistant_settings['advanced_analysis'] = self.assistant_analysis_var.get()
+            self.assistant_settings['prompt_lookup'] = self.assistant_lookup_var.get()
+            self.assistant_settings['neuroshift'] = self.assistant_neuroshift_var.get()
+            self.assistant_settings['answer_cache'] = self.assistant_cache_var.get()
+            self.apply_engine_settings(answer_cache_threshold=self.assistant_threshold_var.get())
             messagebox.showinfo("Сохранено", "Настройки сохранены!")
         
         apply_btn = tk.Button(button_frame, text=lang["apply"],
@@ -806,49 +3652,84 @@ class ModernGPTLauncher:
                     self.translate_enabled = config.get('translate_enabled', False)
                     self.auto_translate = config.get('auto_translate', False)
                     self.target_translate_lang = config.get('target_translate_lang', 'en')
+                    self.preload_on_startup = config.get('preload_on_startup', True)
+                    self.inference_server = config.get('inference_server', "")
+                    self.chat_storage = config.get('chat_storage', "journal")
+                    self.persistence_interval = config.get('persistence_interval_s', 2.0)
+                    self.open_chats_limit = config.get('open_chats_limit', 8)
+                    self.engine_config = config
                     self.theme_colors = self.colors[self.current_theme]
         except Exception as e:
             print(f"Ошибка загрузки конфига: {e}")
     
     def save_config(self):
+        """Снимает конфиг в потоке окна; запись идёт в фоновом потоке"""
+        self.config_snapshot = {
+            'language': self.language,
+            'model_type': self.model_type,
+            'theme': self.current_theme,
+            'translate_enabled': self.translate_enabled,
+            'auto_translate': self.auto_translate,
+            'target_translate_lang': self.target_translate_lang,
+            'preload_on_startup': self.preload_on_startup,
+            'inference_server': self.inference_server,
+            'chat_storage': self.chat_storage,
+            'persistence_interval_s': self.persistence_interval,
+            'open_chats_limit': self.open_chats_limit,
+            **copy.deepcopy(self.engine.get_config())
+        }
+        self.persistence.mark_dirty('config')
+    
+    def write_config(self):
         try:
-            config = {
-                'language': self.language,
-                'model_type': self.model_type,
-                'theme': self.current_theme,
-                'translate_enabled': self.translate_enabled,
-                'auto_translate': self.auto_translate,
-                'target_translate_lang': self.target_translate_lang,
-                'saved_at': datetime.now().isoformat()
-            }
-            with open(self.config_file, 'w', encoding='utf-8') as f:
-                json.dump(config, f, ensure_ascii=False, indent=2)
+            atomic_write_json(self.config_file, dict(self.config_snapshot, saved_at=datetime.now().isoformat()))
         except Exception as e:
             print(f"Ошибка сохранения конфига: {e}")
     
     def load_chats_data(self):
         try:
-            if os.path.exists(self.data_file):
-                with open(self.data_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    self.chats = data.get('chats', [])
-                    self.chat_data = data.get('chat_data', {})
+            self.chats, self.chat_data = self.chat_store.load()
         except Exception as e:
             print(f"Ошибка загрузки чатов: {e}")
             self.chats = []
             self.chat_data = {}
     
     def save_chats_data(self):
-        try:
-            data = {
-                'chats': self.chats,
-                'chat_data': self.chat_data,
-                'saved_at': datetime.now().isoformat()
-            }
-            with open(self.data_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"Ошибка сохранения чатов: {e}")
+        """Снимает копию индекса чатов; сообщения пишутся в хранилище по мере появления.
+        
+        Фоновый поток пишет только последнюю копию и не трогает списки, которые меняет окно.
+        """
+        self.chats_snapshot = ([dict(chat) for chat in self.chats], copy.deepcopy(self.chat_data))
+        self.persistence.mark_dirty('chats')
+    
+    def write_chats_index(self):
+        chats, chat_data = self.chats_snapshot
+        self.chat_store.save_index(chats, chat_data)
+    
+    def get_chat_messages(self, chat_id):
+        """Сообщения чата: из LRU открытых чатов или из хранилища"""
+        if chat_id in self.open_chats:
+            self.open_chats.move_to_end(chat_id)
+            return self.open_chats[chat_id]
+        return self.remember_chat_messages(chat_id, self.chat_store.get_messages(chat_id))
+    
+    def remember_chat_messages(self, chat_id, messages):
+        """Кладёт сообщения чата в LRU, вытесняя давно не открывавшиеся чаты"""
+        self.open_chats[chat_id] = messages
+        self.open_chats.move_to_end(chat_id)
+        while len(self.open_chats) > max(1, self.open_chats_limit):
+            self.open_chats.popitem(last=False)
+        return messages
+    
+    def append_chat_message(self, message):
+        """Добавляет сообщение в текущий чат и дописывает его в хранилище"""
+        for chat in self.chats:
+            if chat['id'] == self.current_chat_id:
+                messages = self.get_chat_messages(chat['id'])
+                messages.append(message)
+                chat['message_count'] = len(messages)
+                self.chat_store.append_message(chat['id'], message)
+                break
     
     def create_widgets(self):
         self.root.configure(bg=self.theme_colors['bg'])
@@ -1112,6 +3993,18 @@ class ModernGPTLauncher:
                                            cursor='hand2',
                                            command=self.send_to_assistant)
         self.assistant_send_btn.pack(side=tk.RIGHT)
+        
+        self.assistant_stop_btn = tk.Button(button_frame, text="",
+                                           font=self.fonts['body'],
+                                           bg=self.theme_colors['card'],
+                                           fg=self.theme_colors['text'],
+                                           bd=0,
+                                           padx=20,
+                                           pady=10,
+                                           cursor='hand2',
+                                           state=tk.DISABLED,
+                                           command=lambda: self.stop_generation('assistant'))
+        self.assistant_stop_btn.pack(side=tk.RIGHT, padx=(0, 10))
     
     def create_assistant_right_sidebar(self, parent):
         self.assistant_right_sidebar = tk.Frame(parent, bg=self.theme_colors['sidebar'], width=300)
@@ -1151,6 +4044,45 @@ class ModernGPTLauncher:
                                         bg=self.theme_colors['card'], fg=self.theme_colors['text_secondary'],
                                         justify=tk.LEFT, wraplength=250)
         self.last_search_info.pack(anchor='w', padx=15, pady=(0, 15))
+        
+        cache_card = tk.Frame(self.assistant_right_sidebar, bg=self.theme_colors['card'])
+        cache_card.pack(fill=tk.X, padx=20, pady=(0, 20))
+        
+        cache_label = tk.Label(cache_card, text="prompt cache", font=self.fonts['h3'],
+                              bg=self.theme_colors['card'], fg=self.theme_colors['text'])
+        cache_label.pack(anchor='w', padx=15, pady=(15, 10))
+        
+        self.prefix_cache_info = tk.Label(cache_card, text="No requests",
+                                         font=self.fonts['small'],
+                                         bg=self.theme_colors['card'], fg=self.theme_colors['text_secondary'],
+                                         justify=tk.LEFT, wraplength=250)
+        self.prefix_cache_info.pack(anchor='w', padx=15, pady=(0, 15))
+        
+        latency_card = tk.Frame(self.assistant_right_sidebar, bg=self.theme_colors['card'])
+        latency_card.pack(fill=tk.X, padx=20, pady=(0, 20))
+        
+        latency_label = tk.Label(latency_card, text="latency p50 / p95", font=self.fonts['h3'],
+                                bg=self.theme_colors['card'], fg=self.theme_colors['text'])
+        latency_label.pack(anchor='w', padx=15, pady=(15, 10))
+        
+        self.latency_info = tk.Label(latency_card, text="No requests",
+                                    font=self.fonts['small'],
+                                    bg=self.theme_colors['card'], fg=self.theme_colors['text_secondary'],
+                                    justify=tk.LEFT, wraplength=250)
+        self.latency_info.pack(anchor='w', padx=15, pady=(0, 15))
+        
+        translator_card = tk.Frame(self.assistant_right_sidebar, bg=self.theme_colors['card'])
+        translator_card.pack(fill=tk.X, padx=20, pady=(0, 20))
+        
+        translator_label = tk.Label(translator_card, text="translator", font=self.fonts['h3'],
+                                   bg=self.theme_colors['card'], fg=self.theme_colors['text'])
+        translator_label.pack(anchor='w', padx=15, pady=(15, 10))
+        
+        self.translator_info = tk.Label(translator_card, text="No requests",
+                                       font=self.fonts['small'],
+                                       bg=self.theme_colors['card'], fg=self.theme_colors['text_secondary'],
+                                       justify=tk.LEFT, wraplength=250)
+        self.translator_info.pack(anchor='w', padx=15, pady=(0, 15))
     
     def create_sidebar(self, parent):
         self.sidebar = tk.Frame(parent, bg=self.theme_colors['sidebar'], width=280)
@@ -1458,6 +4390,18 @@ class ModernGPTLauncher:
                                  cursor='hand2',
                                  command=self.send_message)
         self.send_btn.pack(side=tk.RIGHT)
+        
+        self.stop_btn = tk.Button(button_frame, text="", 
+                                 font=self.fonts['body'],
+                                 bg=self.theme_colors['card'],
+                                 fg=self.theme_colors['text'],
+                                 bd=0,
+                                 padx=20,
+                                 pady=10,
+                                 cursor='hand2',
+                                 state=tk.DISABLED,
+                                 command=lambda: self.stop_generation('chat'))
+        self.stop_btn.pack(side=tk.RIGHT, padx=(0, 10))
     
     def create_right_sidebar(self, parent):
         self.right_sidebar = tk.Frame(parent, bg=self.theme_colors['sidebar'], width=300)
@@ -1484,6 +4428,7 @@ class ModernGPTLauncher:
                                         selectcolor=self.theme_colors['primary'],
                                         command=lambda: self.load_model("GPT-1"))
         self.gpt1_radio.pack(anchor='w', padx=15, pady=5)
+        self.gpt1_radio.bind('<Enter>', lambda e: self.preload_model("GPT-1"))
         
         self.gpt2_radio = tk.Radiobutton(card, text="",
                                         variable=self.model_var, value="GPT-2",
@@ -1493,6 +4438,7 @@ class ModernGPTLauncher:
                                         selectcolor=self.theme_colors['primary'],
                                         command=lambda: self.load_model("GPT-2"))
         self.gpt2_radio.pack(anchor='w', padx=15, pady=5)
+        self.gpt2_radio.bind('<Enter>', lambda e: self.preload_model("GPT-2"))
         
         lang_card = tk.Frame(self.right_sidebar, bg=self.theme_colors['card'])
         lang_card.pack(fill=tk.X, padx=20, pady=(0, 20))
@@ -1592,6 +4538,7 @@ class ModernGPTLauncher:
         self.auto_translate_check.config(text=lang["auto_translate"])
         
         self.send_btn.config(text=f"↗️ {lang['send']}")
+        self.stop_btn.config(text=f"⏹ {lang['stop']}")
         
         self.assistant_title.config(text=lang["smart_assistant"])
         self.assistant_chat_title.config(text=lang["smart_assistant"])
@@ -1599,6 +4546,7 @@ class ModernGPTLauncher:
         self.load_txt_btn.config(text=f"📁 {lang['load_txt']}")
         
         self.assistant_send_btn.config(text=f"↗️ {lang['send']}")
+        self.assistant_stop_btn.config(text=f"⏹ {lang['stop']}")
         
         if hasattr(self, 'copy_all_btn'):
             self.copy_all_btn.config(text=lang["copy_all_dialogue"])
@@ -1707,11 +4655,11 @@ class ModernGPTLauncher:
             self.assistant_input_text.configure(fg=self.theme_colors['text'])
     
     def send_to_assistant(self):
-        if not TRANSFORMERS_AVAILABLE:
+        if not self.inference_available:
             messagebox.showwarning("Ошибка", "Установите библиотеки transformers и torch")
             return
             
-        if not self.current_model:
+        if not self.model_ready:
             messagebox.showwarning("Ошибка", "Модель не загружена")
             return
         
@@ -1736,77 +4684,42 @@ class ModernGPTLauncher:
         self.set_assistant_placeholder()
         
         self.assistant_chat_display.config(state=tk.NORMAL)
+        # Метка начала ответа: строка «думает» заменяется первым переведённым предложением
+        self.assistant_chat_display.mark_set('assistant_pending', 'end-1c')
+        self.assistant_chat_display.mark_gravity('assistant_pending', 'left')
+        self.assistant_answer_started = False
         self.assistant_chat_display.insert('end', f"{lang['assistant_thinking']}\n", 'knowledge_info')
         self.assistant_chat_display.see('end')
         self.assistant_chat_display.config(state=tk.DISABLED)
         
         self.assistant_send_btn.config(text=f" {lang['generating']}", state=tk.DISABLED)
+        self.assistant_stop_btn.config(state=tk.NORMAL)
+        
+        model_name = self.model_type
+        cancel_event = self.cancel_events['assistant']
+        cancel_event.clear()
+        
+        settings = dict(self.assistant_settings)
         
         def process_with_knowledge():
             try:
-                similar_results = self.knowledge_base.find_similar(user_message, threshold=0.3)
-                
-                context_parts = []
-                if similar_results:
-                    for result in similar_results[:3]:
-                        item = result['item']
-                        if item.get('english'):
-                            context_parts.append(f"Russian: {item['russian']}")
-                            context_parts.append(f"English: {item['english']}")
-                        else:
-                            context_parts.append(f"Text: {item['russian']}")
-                        if item.get('context'):
-                            context_parts.append(f"Context: {item['context']}")
-                
-                if context_parts:
-                    context_text = "\n".join(context_parts)
-                    prompt = f"Based on this knowledge:\n{context_text}\n\nQuestion: {user_message}\nAnswer in English:"
-                else:
-                    prompt = f"Question: {user_message}\nAnswer in English:"
-                
-                if TRANSLATOR_AVAILABLE:
-                    try:
-                        translation = translator.translate(prompt, dest='en')
-                        english_prompt = translation.text
-                    except:
-                        english_prompt = prompt
-                else:
-                    english_prompt = prompt
-                
-                input_ids = self.current_tokenizer.encode(english_prompt, return_tensors="pt").to(self.current_device)
-                
-                with torch.no_grad():
-                    output = self.current_model.generate(
-                        input_ids,
-                        max_new_tokens=self.assistant_settings['response_length'],  # Используем настройку длины
-                        temperature=self.assistant_settings['temperature'],  # Используем настройку креативности
-                        do_sample=True,
-                        top_p=0.9,
-                        repetition_penalty=1.1,
-                        pad_token_id=self.current_tokenizer.pad_token_id if hasattr(self.current_tokenizer, 'pad_token_id') else None,
-                        eos_token_id=self.current_tokenizer.eos_token_id if hasattr(self.current_tokenizer, 'eos_token_id') else None
-                    )
-                
-                english_response = self.current_tokenizer.decode(output[0], skip_special_tokens=True)
-                
-                if english_response.startswith(english_prompt):
-                    english_response = english_response[len(english_prompt):].strip()
-                
-                if TRANSLATOR_AVAILABLE:
-                    try:
-                        translation_back = translator.translate(english_response, dest='ru')
-                        russian_response = translation_back.text
-                    except:
-                        russian_response = english_response
-                else:
-                    russian_response = english_response
+                result = self.inference.answer_question(
+                    model_name, user_message, settings, cancel_event,
+                    lambda sentence: self.message_queue.put((self._append_assistant_partial, (sentence,))))
+                if self.inference is not self.engine:
+                    # Метрики и префиксный кэш живут на сервере, окну нужны только данные для панели
+                    if result.get('timings'):
+                        self.engine.metrics.observe('assistant', result['timings'])
+                    result['prefix_cache'] = self.inference.get_stats()['prefix_cache']
                 
                 knowledge_info = ""
-                if similar_results:
-                    knowledge_info = f"📚 {lang['using_knowledge']}: {len(similar_results)} {lang['found_similar'].lower()}"
+                if result['knowledge_count']:
+                    knowledge_info = f"📚 {lang['using_knowledge']}: {result['knowledge_count']} {lang['found_similar'].lower()}"
+                if result.get('cached'):
+                    knowledge_info = " · ".join(filter(None, [f"⚡ {lang['cached_answer']}", knowledge_info]))
                 
                 self.message_queue.put((self._finish_assistant_response, 
-                                      (russian_response, knowledge_info, timestamp)))
+                                      (result['answer'], knowledge_info, timestamp, result)))
                 
             except Exception as e:
                 error_msg = f"Ошибка: {str(e)}" if self.language == "Русский" else f"Error: {str(e)}"
@@ -1815,13 +4728,29 @@ class ModernGPTLauncher:
         thread = threading.Thread(target=process_with_knowledge, daemon=True)
         thread.start()
     
-    def _finish_assistant_response(self, russian_response, knowledge_info, timestamp):
+    def stop_generation(self, target):
+        """Прерывает текущую генерацию в чате или в помощнике"""
+        self.cancel_events[target].set()
+    
+    def _append_assistant_partial(self, sentence):
+        """Дописывает в чат помощника очередное переведённое предложение, пока ответ ещё генерируется"""
+        self.assistant_chat_display.config(state=tk.NORMAL)
+        if not self.assistant_answer_started:
+            self.assistant_chat_display.delete('assistant_pending', 'end')
+            self.assistant_chat_display.insert('end', f"Помощник: ", 'assistant_header')
+            self.assistant_answer_started = True
+        self.assistant_chat_display.insert('end', sentence, 'message')
+        self.assistant_chat_display.see('end')
+        self.assistant_chat_display.config(state=tk.DISABLED)
+    
+    def _finish_assistant_response(self, russian_response, knowledge_info, timestamp, result=None):
         """Завершает обработку ответа помощника"""
         self.add_to_assistant_history('assistant', russian_response, knowledge_info)
         
         self.assistant_chat_display.config(state=tk.NORMAL)
         
-        self.assistant_chat_display.delete('end-1l linestart', 'end')
+        # Черновик из потоковых предложений заменяется окончательным ответом
+        self.assistant_chat_display.delete('assistant_pending', 'end')
         
         self.assistant_chat_display.insert('end', f"Помощник: ", 'assistant_header')
         self.assistant_chat_display.insert('end', f"{russian_response}", 'message')
@@ -1837,6 +4766,55 @@ class ModernGPTLauncher:
         
         lang = self.language_dict[self.language]
         self.assistant_send_btn.config(text=f" {lang['send']}", state=tk.NORMAL)
+        self.assistant_stop_btn.config(state=tk.DISABLED)
+        
+        self.update_prefix_cache_info((result or {}).get('prefix_cache'))
+        self.update_latency_info(result or {})
+        self.update_translator_info((result or {}).get('translator'))
+    
+    def update_latency_info(self, result):
+        """Показывает p50/p95 времени этапов последних запросов помощника"""
+        summary = self.engine.metrics.summary('assistant')
+        if not summary:
+            return
+        lines = [f"{stage}: {p50 * 1000:.0f} / {p95 * 1000:.0f} мс" for stage, (p50, p95) in summary.items()]
+        if result.get('tokens_per_s'):
+            lines.append(f"Последний ответ: {result['tokens_per_s']:.1f} ток/с")
+        peak_rss_mb = result.get('memory', {}).get('peak_rss_mb')
+        if peak_rss_mb:
+            lines.append(f"Пик памяти: {peak_rss_mb:.0f} МБ")
+        self.latency_info.config(text="\n".join(lines))
+    
+    def update_translator_info(self, state=None):
+        """Показывает состояние предохранителя переводчика"""
+        if not TRANSLATOR_AVAILABLE and self.inference is self.engine:
+            self.translator_info.config(text="Переводчик не установлен", fg=self.theme_colors['warning'])
+            return
+        state = state or self.engine.translation_breaker.get_state()
+        if state['state'] == 'open':
+            self.translator_info.config(text=f"⛔ Отключён после сбоев, повтор через {state['retry_in']} с",
+                                        fg=self.theme_colors['danger'])
+        elif state['state'] == 'half_open':
+            self.translator_info.config(text="⚠️ Пробный запрос после сбоев", fg=self.theme_colors['warning'])
+        elif state['state'] == 'busy':
+            self.translator_info.config(text="⛔ Все потоки заняты зависшими запросами",
+                                        fg=self.theme_colors['danger'])
+        elif state['failures']:
+            self.translator_info.config(text=f"⚠️ Работает, сбоев подряд: {state['failures']}",
+                                        fg=self.theme_colors['warning'])
+        else:
+            self.translator_info.config(text="✓ Работает", fg=self.theme_colors['success'])
+    
+    def update_prefix_cache_info(self, stats=None):
+        """Показывает статистику префиксного кэша в правой панели помощника (в режиме клиента — с сервера)"""
+        stats = stats or self.engine.prefix_cache.get_stats()
+        if not stats['lookups']:
+            return
+        self.prefix_cache_info.config(
+            text=f"Попаданий: {stats['hit_rate']:.0%} ({stats['hits']}/{stats['lookups']})\n"
+                 f"Токенов из кэша: {stats['token_hit_rate']:.0%}\n"
+                 f"Записей: {stats['entries']}, {stats['size_mb']:.1f}/{stats['budget_mb']} МБ"
+        )
     
     def on_assistant_click(self, event):
         """Обрабатывает клик в чате помощника для копирования"""
@@ -1866,7 +4844,7 @@ class ModernGPTLauncher:
         
         self.assistant_chat_display.config(state=tk.NORMAL)
         
-        self.assistant_chat_display.delete('end-1l linestart', 'end')
+        self.assistant_chat_display.delete('assistant_pending', 'end')
         
         self.assistant_chat_display.insert('end', f"Система: {error_msg}\n\n", 'system_header')
         
@@ -1875,6 +4853,7 @@ class ModernGPTLauncher:
         
         lang = self.language_dict[self.language]
         self.assistant_send_btn.config(text=f" {lang['send']}", state=tk.NORMAL)
+        self.assistant_stop_btn.config(state=tk.DISABLED)
     
     def on_assistant_enter_pressed(self, event):
         """Обрабатывает нажатие Enter в поле ввода помощника"""
@@ -1915,8 +4894,9 @@ class ModernGPTLauncher:
         for widget in self.chats_scrollable_frame.winfo_children():
             widget.destroy()
         
+        found = set(self.chat_store.search_chats(search_term))
         for chat in self.chats:
-            if search_term in chat['name'].lower():
+            if chat['id'] in found:
                 self.create_chat_widget(chat)
     
     def create_chat_widget(self, chat):
@@ -1953,6 +4933,10 @@ class ModernGPTLauncher:
         print("Закрытие приложения...")
         self.save_chats_data()
         self.save_config()  # Сохраняем только конфиг, историю помощника не сохраняем
+        # Несохранённые изменения дописываются до закрытия окна
+        self.persistence.close()
+        self.chat_store.close()
+        self.engine.close()
         if hasattr(self, 'log_file'):
             self.log_file.close()
         self.root.destroy()
@@ -1977,36 +4961,28 @@ class ModernGPTLauncher:
         self.send_message()
         return 'break'
     
-    def load_model(self, model_name):
-        if not TRANSFORMERS_AVAILABLE:
+    def load_model(self, model_name, warmup=False):
+        if not self.inference_available:
             print("Библиотеки transformers/torch не установлены")
             lang = self.language_dict[self.language]
             self.model_status.config(text="Тестовый режим (установите transformers)", 
                                    fg=self.theme_colors['warning'])
             return
-            
+        
         self.model_type = model_name
         self.model_var.set(model_name)
         lang = self.language_dict[self.language]
         
+        if self.inference is self.engine and self.engine.model_pool.get(model_name):
+            self._finish_model_load(model_name, lang)
+            return
+        
+        self.model_ready = False
+        
         def load_model_thread():
             try:
-                print(f"Загрузка модели {model_name}...")
-                if model_name == "GPT-1":
-                    tokenizer = OpenAIGPTTokenizer.from_pretrained("openai-community/openai-gpt")
-                    model = OpenAIGPTLMHeadModel.from_pretrained("openai-community/openai-gpt")
-                else:
-                    tokenizer = AutoTokenizer.from_pretrained("openai-community/gpt2")
-                    model = AutoModelForCausalLM.from_pretrained("openai-community/gpt2")
-                    if tokenizer.pad_token is None:
-                        tokenizer.pad_token = tokenizer.eos_token
-                
-                device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-                model = model.to(device)
-                
-                self.message_queue.put((self._finish_model_load, 
-                                      (model_name, tokenizer, model, device, lang)))
-                print(f"Модель {model_name} загружена успешно")
+                self.inference.get_model(model_name, warmup=warmup)
+                self.message_queue.put((self._finish_model_load, (model_name, lang)))
                 
             except Exception as e:
                 print(f"Ошибка загрузки модели: {e}")
@@ -2017,18 +4993,79 @@ class ModernGPTLauncher:
         
         self.model_status.config(text=f"{model_name} ● {lang['loading']}", fg=self.theme_colors['warning'])
     
-    def _finish_model_load(self, model_name, tokenizer, model, device, lang):
-        self.current_tokenizer = tokenizer
-        self.current_model = model
-        self.current_device = device
-        self.model_type = model_name
+    def apply_engine_settings(self, **changes):
+        """Меняет настройки движка (и сервера в режиме клиента); при смене настроек загрузки
+        весов сразу перезагружает активную модель"""
+        reloaded = self.engine.update_config(changes)
+        if self.inference is not self.engine:
+            try:
+                reloaded = self.inference.update_config(changes)
+            except Exception as e:
+                messagebox.showerror("Ошибка", f"Сервер не принял настройки: {e}")
+        self.save_config()
+        if reloaded and self.model_ready:
+            self.load_model(self.model_type)
+    
+    def calibrate_threads(self):
+        """Замеряет скорость генерации при разном числе потоков и сохраняет лучшее"""
+        if not self.model_ready:
+            messagebox.showwarning("Ошибка", "Модель не загружена")
+            return
+        
+        model_name = self.model_type
+        
+        def calibrate_thread():
+            try:
+                best, results = self.inference.calibrate_threads(model_name)
+                self.message_queue.put((self._finish_thread_calibration, (best, results)))
+            except Exception as e:
+                print(f"Ошибка калибровки потоков: {e}")
+                self.message_queue.put((messagebox.showerror, ("Ошибка", str(e))))
+        
+        threading.Thread(target=calibrate_thread, daemon=True).start()
+        messagebox.showinfo("Калибровка", "Калибровка потоков запущена, это займёт около минуты")
+    
+    def _finish_thread_calibration(self, best, results):
+        if self.inference is not self.engine:
+            # Сервер config.json не пишет: подобранные им потоки сохраняются в конфиге окна,
+            # откуда их прочитает и перезапущенный сервер
+            self.engine.update_config({'torch_threads': self.inference.torch_threads,
+                                       'torch_interop_threads': self.inference.torch_interop_threads})
+        self.save_config()
+        
+        lines = [f"{threads}: {speed:.1f} ток/с" for threads, speed in sorted(results.items())]
+        messagebox.showinfo("Калибровка", "\n".join(lines) + f"\n\nВыбрано потоков: {best}")
+    
+    def preload_model(self, model_name):
+        """Фоново подгружает модель при наведении, чтобы переключение было мгновенным"""
+        if model_name == self.model_type:
+            return
+        if self.inference.preload(model_name):
+            print(f"Фоновая подгрузка модели {model_name}...")
+    
+    def _finish_model_load(self, model_name, lang):
+        if model_name != self.model_type:
+            return
+        
+        self.inference.activate(model_name, precompute=self.assistant_settings['neuroshift'])
+        self.model_ready = True
         
-        device_type = "GPU" if torch.cuda.is_available() else "CPU"
+        device_type = self.inference.describe_model(model_name)
         self.model_status.config(text=f"{model_name} ● {lang['ready']} ({device_type})", 
                                fg=self.theme_colors['success'])
         
         self.save_config()
     
+    def knowledge_base_changed(self):
+        """После изменения базы знаний обновляет переводы записей и кэш Neuroshift (или базу на сервере)"""
+        if self.inference is not self.engine:
+            threading.Thread(target=self.inference.reload_knowledge, daemon=True).start()
+            return
+        
+        self.engine.start_pretranslation()
+        if self.model_ready and self.assistant_settings['neuroshift']:
+            self.engine.start_neuroshift_precompute(self.model_type)
+    
     def _show_model_error(self, model_name, lang, error):
         self.model_status.config(text=f"{lang['load_error']}", fg=self.theme_colors['danger'])
         messagebox.showerror(lang["load_error"], str(error))
@@ -2050,10 +5087,11 @@ class ModernGPTLauncher:
             'created_at': datetime.now().isoformat(),
             'last_modified': datetime.now().isoformat(),
             'model': self.model_type,
-            'messages': []
+            'message_count': 0
         }
         
         self.chats.append(chat_data)
+        self.remember_chat_messages(chat_id, [])
         self.current_chat_id = chat_id
         self.update_chat_list()
         self.load_chat(chat_id)
@@ -2075,8 +5113,9 @@ class ModernGPTLauncher:
         for chat in self.chats:
             if chat['id'] == chat_id:
                 chat_found = True
-                if 'messages' in chat and chat['messages']:
-                    for msg in chat['messages']:
+                messages = self.get_chat_messages(chat_id)
+                if messages:
+                    for msg in messages:
                         self.display_message(msg['role'], msg['content'], 
                                            msg.get('timestamp', ''),
                                            msg.get('translated', None))
@@ -2094,7 +5133,7 @@ class ModernGPTLauncher:
         self.update_chat_list()
     
     def send_message(self):
-        if not TRANSFORMERS_AVAILABLE:
+        if not self.inference_available:
             print("Режим тестирования - отправка сообщения")
             lang = self.language_dict[self.language]
             user_message = self.input_text.get('1.0', 'end-1c').strip()
@@ -2105,14 +5144,11 @@ class ModernGPTLauncher:
             
             timestamp = datetime.now().strftime("%H:%M")
             
-            for chat in self.chats:
-                if chat['id'] == self.current_chat_id:
-                    chat['messages'].append({
-                        'role': 'user',
-                        'content': user_message,
-                        'timestamp': timestamp
-                    })
-                    break
+            self.append_chat_message({
+                'role': 'user',
+                'content': user_message,
+                'timestamp': timestamp
+            })
             
             self.display_message("user", user_message, timestamp)
             self.input_text.delete('1.0', 'end')
@@ -2120,20 +5156,16 @@ class ModernGPTLauncher:
             
             response = "Это тестовый ответ. Для работы с реальными моделями GPT установите библиотеки: pip install transformers torch"
             
-            for chat in self.chats:
-                if chat['id'] == self.current_chat_id:
-                    chat['messages'].append({
-                        'role': 'assistant',
-                        'content': response,
-                        'timestamp': timestamp
-                    })
-                    break
+            self.append_chat_message({
+                'role': 'assistant',
+                'content': response,
+                'timestamp': timestamp
+            })
             
             self.display_message("assistant", response, timestamp)
-            self.save_chats_data()
             return
             
-        if not self.current_model:
+        if not self.model_ready:
             return
         
         lang = self.language_dict[self.language]
@@ -2145,52 +5177,30 @@ class ModernGPTLauncher:
         
         timestamp = datetime.now().strftime("%H:%M")
         
-        for chat in self.chats:
-            if chat['id'] == self.current_chat_id:
-                chat['messages'].append({
-                    'role': 'user',
-                    'content': user_message,
-                    'timestamp': timestamp
-                })
-                break
+        self.append_chat_message({
+            'role': 'user',
+            'content': user_message,
+            'timestamp': timestamp
+        })
         
         self.display_message("user", user_message, timestamp)
         self.input_text.delete('1.0', 'end')
         self.input_text.configure(fg=self.theme_colors['text'])
         
         self.send_btn.config(text=f" {lang['generating']}", state=tk.DISABLED)
+        self.stop_btn.config(state=tk.NORMAL)
+        
+        cancel_event = self.cancel_events['chat']
+        cancel_event.clear()
+        
+        model_name = self.model_type
+        max_new_tokens = self.length_var.get()
+        temperature = self.temp_var.get()
         
         def generate_response():
             try:
-                input_ids = self.current_tokenizer.encode(user_message, return_tensors="pt").to(self.current_device)
-                
-                with torch.no_grad():
-                    if self.model_type == "GPT-1":
-                        output = self.current_model.generate(
-                            input_ids,
-                            max_new_tokens=self.length_var.get(),
-                            do_sample=True,
-                            temperature=self.temp_var.get(),
-                            top_p=0.9,
-                            repetition_penalty=1.1
-                        )
-                    else:
-                        output = self.current_model.generate(
-                            input_ids,
-                            max_new_tokens=self.length_var.get(),
-                            temperature=self.temp_var.get(),
-                            do_sample=True,
-                            top_p=0.9,
-                            repetition_penalty=1.1,
-                            no_repeat_ngram_size=2,
-                            pad_token_id=self.current_tokenizer.pad_token_id,
-                            eos_token_id=self.current_tokenizer.eos_token_id
-                        )
-                
-                generated_text = self.current_tokenizer.decode(output[0], skip_special_tokens=True)
-                
-                if self.model_type == "GPT-2" and generated_text.startswith(user_message):
-                    generated_text = generated_text[len(user_message):].strip()
+                generated_text = self.inference.generate_chat(model_name, user_message,
+                                                              max_new_tokens, temperature, cancel_event)
                 
                 translated_text = None
                 if self.translate_enabled and self.auto_translate:
@@ -2208,44 +5218,38 @@ class ModernGPTLauncher:
         thread.start()
     
     def _finish_response(self, generated_text, timestamp, translated_text=None):
-        for chat in self.chats:
-            if chat['id'] == self.current_chat_id:
-                message_data = {
-                    'role': 'assistant',
-                    'content': generated_text,
-                    'timestamp': timestamp
-                }
-                if translated_text:
-                    message_data['translated'] = translated_text
-                chat['messages'].append(message_data)
-                break
+        message_data = {
+            'role': 'assistant',
+            'content': generated_text,
+            'timestamp': timestamp
+        }
+        if translated_text:
+            message_data['translated'] = translated_text
+        self.append_chat_message(message_data)
         
         self.display_message("assistant", generated_text, timestamp, translated_text)
         
         lang = self.language_dict[self.language]
         self.send_btn.config(text=f" {lang['send']}", state=tk.NORMAL)
+        self.stop_btn.config(state=tk.DISABLED)
         
         for chat in self.chats:
             if chat['id'] == self.current_chat_id:
                 chat['last_modified'] = datetime.now().isoformat()
                 break
-        
-        self.save_chats_data()
     
     def _show_error(self, error_msg, timestamp):
-        for chat in self.chats:
-            if chat['id'] == self.current_chat_id:
-                chat['messages'].append({
-                    'role': 'system',
-                    'content': error_msg,
-                    'timestamp': timestamp
-                })
-                break
+        self.append_chat_message({
+            'role': 'system',
+            'content': error_msg,
+            'timestamp': timestamp
+        })
         
         self.display_message("system", error_msg, timestamp)
         
         lang = self.language_dict[self.language]
         self.send_btn.config(text=f" {lang['send']}", state=tk.NORMAL)
+        self.stop_btn.config(state=tk.DISABLED)
     
     def display_message(self, role, content, timestamp="", translated=None):
         self.chat_display.config(state=tk.NORMAL)
@@ -2321,6 +5325,9 @@ class ModernGPTLauncher:
             print("Переводчик не доступен. Установите: pip install googletrans==4.0.0-rc1")
             return None
         
+        if not needs_translation(text, target_lang):
+            return text
+        
         try:
             translation = translator.translate(text, dest=target_lang)
             return translation.text
@@ -2360,7 +5367,8 @@ class ModernGPTLauncher:
                 if file_path:
                     try:
                         with open(file_path, 'w', encoding='utf-8') as f:
-                            json.dump(chat, f, ensure_ascii=False, indent=2)
+                            json.dump(dict(chat, messages=self.get_chat_messages(chat['id'])),
+                                      f, ensure_ascii=False, indent=2)
                         
                         messagebox.showinfo(lang["export_success"], lang["export_success"])
                     except Exception as e:
@@ -2387,7 +5395,11 @@ class ModernGPTLauncher:
                     timestamp = datetime.now().strftime("%d.%m %H:%M")
                     chat_data['name'] = f"{lang['chat_prefix']}{len(self.chats) + 1} • {timestamp} (импорт)"
                 
+                self.chat_store.write_chat(chat_data)
+                messages = chat_data.pop('messages', [])
+                chat_data['message_count'] = len(messages)
                 self.chats.append(chat_data)
+                self.remember_chat_messages(chat_id, messages)
                 self.current_chat_id = chat_id
                 self.update_chat_list()
                 self.load_chat(chat_id)
@@ -2404,11 +5416,12 @@ class ModernGPTLauncher:
         if messagebox.askyesno(lang["clear_chat"], lang["confirm_clear"]):
             for chat in self.chats:
                 if chat['id'] == self.current_chat_id:
-                    chat['messages'] = []
+                    chat['message_count'] = 0
+                    self.remember_chat_messages(chat['id'], [])
+                    self.chat_store.clear_chat(chat['id'])
                     break
             
             self.load_chat(self.current_chat_id)
-            self.save_chats_data()
     
     def show_statistics(self):
         stats_window = tk.Toplevel(self.root)
@@ -2420,24 +5433,14 @@ class ModernGPTLauncher:
         center_frame = tk.Frame(stats_window, bg=self.theme_colors['bg'])
         center_frame.pack(expand=True, fill=tk.BOTH, padx=50, pady=50)
         
-        total_messages = 0
-        total_chars = 0
-        total_words = 0
-        
-        for chat in self.chats:
-            if 'messages' in chat:
-                total_messages += len(chat['messages'])
-                for msg in chat['messages']:
-                    content = msg.get('content', '')
-                    total_chars += len(content)
-                    total_words += len(content.split())
+        totals = self.chat_store.get_statistics()
         
         lang = self.language_dict[self.language]
         
         stats = [
-            (f"📊 {lang['total']} {lang['messages']}:", f"{total_messages}"),
-            (f"📝 {lang['total']} {lang['chars']}:", f"{total_chars}"),
-            (f"📖 {lang['total']} {lang['words']}:", f"{total_words}"),
+            (f"📊 {lang['total']} {lang['messages']}:", f"{totals['messages']}"),
+            (f"📝 {lang['total']} {lang['chars']}:", f"{totals['chars']}"),
+            (f"📖 {lang['total']} {lang['words']}:", f"{totals['words']}"),
             (f"💬 {lang['chats']}:", f"{len(self.chats)}")
         ]
         
@@ -2456,7 +5459,7 @@ class ModernGPTLauncher:
     def open_settings(self):
         settings_window = tk.Toplevel(self.root)
         settings_window.title(self.language_dict[self.language]["api_settings"])
-        settings_window.geometry("500x300")
+        settings_window.geometry("600x740")
         settings_window.configure(bg=self.theme_colors['bg'])
         settings_window.resizable(False, False)
         
@@ -2475,6 +5478,171 @@ class ModernGPTLauncher:
                              justify=tk.LEFT)
         note_label.pack(anchor='w', pady=(0, 20))
         
+        pool_frame = tk.Frame(center_frame, bg=self.theme_colors['bg'])
+        pool_frame.pack(fill=tk.X, pady=5)
+        
+        pool_label = tk.Label(pool_frame, text="Память под модели (МБ):",
+                             font=self.fonts['body'],
+                             bg=self.theme_colors['bg'], fg=self.theme_colors['text'])
+        pool_label.pack(side=tk.LEFT)
+        
+        pool_budget_var = tk.IntVar(value=self.engine.model_pool_budget_mb)
+        
+        def apply_pool_budget():
+            try:
+                budget_mb = max(256, int(pool_budget_var.get()))
+            except (tk.TclError, ValueError):
+                return
+            self.apply_engine_settings(model_pool_budget_mb=budget_mb)
+        
+        pool_spin = tk.Spinbox(pool_frame, from_=256, to=65536, increment=256,
+                              textvariable=pool_budget_var,
+                              width=8,
+                              font=self.fonts['body'],
+                              command=apply_pool_budget)
+        pool_spin.pack(side=tk.RIGHT)
+        pool_spin.bind('<Return>', lambda e: apply_pool_budget())
+        pool_spin.bind('<FocusOut>', lambda e: apply_pool_budget())
+        
+        chunk_frame = tk.Frame(center_frame, bg=self.theme_colors['bg'])
+        chunk_frame.pack(fill=tk.X, pady=5)
+        
+        chunk_label = tk.Label(chunk_frame, text="Размер куска предзаполнения (токенов, 0 — целиком):",
+                              font=self.fonts['body'],
+                              bg=self.theme_colors['bg'], fg=self.theme_colors['text'])
+        chunk_label.pack(side=tk.LEFT)
+        
+        chunk_var = tk.IntVar(value=self.engine.prefill_chunk_tokens)
+        
+        def apply_chunk_size():
+            try:
+                chunk_tokens = max(0, int(chunk_var.get()))
+            except (tk.TclError, ValueError):
+                return
+            self.apply_engine_settings(prefill_chunk_tokens=chunk_tokens)
+        
+        chunk_spin = tk.Spinbox(chunk_frame, from_=0, to=4096, increment=32,
+                               textvariable=chunk_var,
+                               width=8,
+                               font=self.fonts['body'],
+                               command=apply_chunk_size)
+        chunk_spin.pack(side=tk.RIGHT)
+        chunk_spin.bind('<Return>', lambda e: apply_chunk_size())
+        chunk_spin.bind('<FocusOut>', lambda e: apply_chunk_size())
+        
+        preload_var = tk.BooleanVar(value=self.preload_on_startup)
+        
+        def toggle_preload():
+            self.preload_on_startup = preload_var.get()
+            self.save_config()
+        
+        preload_check = tk.Checkbutton(center_frame, text="Загружать и прогревать модель при запуске",
+                                      variable=preload_var,
+                                      command=toggle_preload,
+                                      font=self.fonts['body'],
+                                      bg=self.theme_colors['bg'],
+                                      fg=self.theme_colors['text'],
+                                      selectcolor=self.theme_colors['primary'])
+        preload_check.pack(anchor='w', pady=5)
+        
+        compile_var = tk.BooleanVar(value=self.engine.compile_model)
+        
+        def toggle_compile():
+            self.apply_engine_settings(compile_model=compile_var.get())
+        
+        compile_check = tk.Checkbutton(center_frame, text="Компилировать модель (torch.compile, модель перезагрузится)",
+                                      variable=compile_var,
+                                      command=toggle_compile,
+                                      font=self.fonts['body'],
+                                      bg=self.theme_colors['bg'],
+                                      fg=self.theme_colors['text'],
+                                      selectcolor=self.theme_colors['primary'])
+        compile_check.pack(anchor='w', pady=5)
+        
+        threads_text = f"Потоки torch: {self.engine.torch_threads}" if self.engine.torch_threads else "Потоки torch: авто"
+        calibrate_btn = tk.Button(center_frame, text=f"⚙️ Калибровка потоков ({threads_text})",
+                                 font=self.fonts['body'],
+                                 bg=self.theme_colors['card'],
+                                 fg=self.theme_colors['text'],
+                                 bd=0,
+                                 padx=20,
+                                 pady=8,
+                                 cursor='hand2',
+                                 command=self.calibrate_threads)
+        calibrate_btn.pack(anchor='w', pady=5)
+        
+        def arm_profiler():
+            self.inference.profile_next_request()
+            messagebox.showinfo("Профилирование",
+                                "Следующий запрос чата или помощника будет записан профилировщиком.\n"
+                                f"Файлы появятся в {os.path.join(self.data_dir, 'logs')}")
+        
+        profile_btn = tk.Button(center_frame, text="🔬 Профилировать следующий запрос",
+                               font=self.fonts['body'],
+                               bg=self.theme_colors['card'],
+                               fg=self.theme_colors['text'],
+                               bd=0,
+                               padx=20,
+                               pady=8,
+                               cursor='hand2',
+                               command=arm_profiler)
+        profile_btn.pack(anchor='w', pady=5)
+        
+        low_memory_var = tk.BooleanVar(value=self.engine.low_memory_loading)
+        
+        def toggle_low_memory():
+            self.apply_engine_settings(low_memory_loading=low_memory_var.get())
+        
+        low_memory_check = tk.Checkbutton(center_frame, text="Экономная загрузка весов (mmap safetensors, модель перезагрузится)",
+                                         variable=low_memory_var,
+                                         command=toggle_low_memory,
+                                         font=self.fonts['body'],
+                                         bg=self.theme_colors['bg'],
+                                         fg=self.theme_colors['text'],
+                                         selectcolor=self.theme_colors['primary'])
+        low_memory_check.pack(anchor='w', pady=5)
+        
+        dtype_frame = tk.Frame(center_frame, bg=self.theme_colors['bg'])
+        dtype_frame.pack(fill=tk.X, pady=5)
+        
+        dtype_label = tk.Label(dtype_frame, text="Точность весов (модель перезагрузится):",
+                              font=self.fonts['body'],
+                              bg=self.theme_colors['bg'], fg=self.theme_colors['text'])
+        dtype_label.pack(side=tk.LEFT)
+        
+        dtype_var = tk.StringVar(value=self.engine.weights_dtype)
+        dtype_combo = ttk.Combobox(dtype_frame, textvariable=dtype_var,
+                                  values=["float32", "bfloat16", "float16"],
+                                  state="readonly", width=10,
+                                  font=self.fonts['body'])
+        dtype_combo.pack(side=tk.RIGHT)
+        
+        def change_dtype(event=None):
+            self.apply_engine_settings(weights_dtype=dtype_var.get())
+        
+        dtype_combo.bind('<<ComboboxSelected>>', change_dtype)
+        
+        translator_frame = tk.Frame(center_frame, bg=self.theme_colors['bg'])
+        translator_frame.pack(fill=tk.X, pady=5)
+        
+        translator_label = tk.Label(translator_frame, text="Переводчик (google — онлайн, marian — локально):",
+                                   font=self.fonts['body'],
+                                   bg=self.theme_colors['bg'], fg=self.theme_colors['text'])
+        translator_label.pack(side=tk.LEFT)
+        
+        translator_var = tk.StringVar(value=self.engine.translator_backend or "")
+        translator_combo = ttk.Combobox(translator_frame, textvariable=translator_var,
+                                       values=["google", "marian"],
+                                       state="readonly", width=10,
+                                       font=self.fonts['body'])
+        translator_combo.pack(side=tk.RIGHT)
+        
+        def change_translator(event=None):
+            self.apply_engine_settings(translator_backend=translator_var.get())
+            translator_var.set(self.engine.translator_backend or "")
+        
+        translator_combo.bind('<<ComboboxSelected>>', change_translator)
+        
         button_frame = tk.Frame(center_frame, bg=self.theme_colors['bg'])
         button_frame.pack(fill=tk.X, pady=(20, 0))
         
@@ -2508,6 +5676,7 @@ class ModernGPTLauncher:
                 self.knowledge_base.load_data()
                 self.update_knowledge_stats()
                 self.load_assistant_chat_history()
+                self.knowledge_base_changed()
             else:
                 messagebox.showerror(lang["import_error"], result['message'])
     
@@ -2515,6 +5684,7 @@ class ModernGPTLauncher:
         """Обновляет базу знаний"""
         self.knowledge_base.load_data()
         self.update_knowledge_stats()
+        self.knowledge_base_changed()
         
         lang = self.language_dict[self.language]
         stats = self.knowledge_base.get_stats()
@@ -2571,7 +5741,124 @@ class ModernGPTLauncher:
                 text=f"Ничего не найдено\nЗапрос: '{search_query}'"
             )
 
+def load_app_config(data_dir):
+    config_file = os.path.join(data_dir, "config.json")
+    if os.path.exists(config_file):
+        with open(config_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return {}
+
+def run_batch(input_path, output_path=None, model_name=None, settings=None, server_url=None):
+    """Прогоняет вопросы из JSONL через конвейер помощника без окна приложения.
+    
+    Каждая строка входа — объект с полем "question" (или "prompt", необязательно "id")
+    либо просто строка. Результаты дописываются в output_path по мере готовности.
+    """
+    data_dir = os.path.join(os.path.expanduser("~"), "Documents", "TrainsFormerAI")
+    config = load_app_config(data_dir)
+    model_name = model_name or config.get('model_type', 'GPT-2')
+    output_path = output_path or os.path.splitext(input_path)[0] + ".results.jsonl"
+    settings = {'response_length': 100, 'temperature': 0.7,
+                'prompt_lookup': True, 'prompt_lookup_tokens': 10, 'neuroshift': True,
+                **(settings or {})}
+    
+    inference = InferenceClient(server_url) if server_url else InferenceEngine(data_dir, config)
+    inference.get_model(model_name, warmup=True)
+    inference.activate(model_name, precompute=False)
+    
+    latencies = []
+    total_tokens = 0
+    start = time.time()
+    with open(input_path, 'r', encoding='utf-8') as source, \
+            open(output_path, 'w', encoding='utf-8') as target:
+        for line_number, line in enumerate(source, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+                if isinstance(record, str):
+                    record = {'question': record}
+                question = record.get('question', record.get('prompt', ''))
+            except (json.JSONDecodeError, AttributeError) as e:
+                error = f"Некорректная запись: {e}"
+                target.write(json.dumps({'id': line_number, 'error': error},
+                                        ensure_ascii=False) + "\n")
+                target.flush()
+                print(f"[строка {line_number}] {error}")
+                continue
+            
+            request_start = time.time()
+            try:
+                result = inference.answer_question(model_name, question, settings)
+            except Exception as e:
+                result = {'error': str(e)}
+            latency = time.time() - request_start
+            latencies.append(latency)
+            total_tokens += result.get('new_tokens', 0)
+            
+            output = {'id': record.get('id', line_number), 'question': question,
+                      **result, 'latency_s': round(latency, 4)}
+            target.write(json.dumps(output, ensure_ascii=False) + "\n")
+            target.flush()
+            print(f"[{len(latencies)}] {latency:.2f} с — {str(question)[:60]}")
+    
+    inference.close()
+    
+    elapsed = max(time.time() - start, 1e-6)
+    print("=" * 50)
+    print(f"Обработано запросов: {len(latencies)} за {elapsed:.1f} с → {output_path}")
+    print(f"Пропускная способность: {len(latencies) / elapsed:.2f} запросов/с, "
+          f"{total_tokens / elapsed:.1f} токенов/с")
+    print(f"Задержка: p50 {percentile(latencies, 50):.2f} с, p90 {percentile(latencies, 90):.2f} с, "
+          f"p99 {percentile(latencies, 99):.2f} с, макс {max(latencies, default=0):.2f} с")
+
+def serve(host="127.0.0.1", port=8765, model_name=None):
+    """Запускает локальный сервер инференса без окна приложения"""
+    data_dir = os.path.join(os.path.expanduser("~"), "Documents", "TrainsFormerAI")
+    config = load_app_config(data_dir)
+    
+    engine = InferenceEngine(data_dir, config)
+    engine.start_pretranslation()
+    model_name = model_name or config.get('model_type', 'GPT-2')
+    if TRANSFORMERS_AVAILABLE:
+        engine.get_model(model_name, warmup=True)
+        engine.activate(model_name)
+    
+    server = InferenceServer(engine, host, port)
+    print(f"Сервер инференса TrainsFormer AI: http://{host}:{port} (модель {model_name})")
+    print("Для подключения окна укажите в config.json: \"inference_server\": \"http://%s:%d\"" % (host, port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nСервер остановлен")
+    finally:
+        server.server_close()
+        engine.close()
+
 def main():
+    parser = argparse.ArgumentParser(description="TrainsFormer AI")
+    parser.add_argument('--serve', action='store_true', help="запустить локальный сервер инференса")
+    parser.add_argument('--host', default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--model', choices=["GPT-1", "GPT-2"])
+    parser.add_argument('--batch', metavar="INPUT.jsonl", help="ответить на вопросы из JSONL без окна")
+    parser.add_argument('--output', metavar="OUTPUT.jsonl")
+    parser.add_argument('--max-new-tokens', type=int, default=100)
+    parser.add_argument('--temperature', type=float, default=0.7)
+    parser.add_argument('--server', metavar="URL", help="использовать запущенный сервер инференса")
+    args = parser.parse_args()
+    
+    if args.serve:
+        serve(args.host, args.port, args.model)
+        return
+    
+    if args.batch:
+        run_batch(args.batch, args.output, args.model,
+                  {'response_length': args.max_new_tokens, 'temperature': args.temperature},
+                  args.server)
+        return
+    
     try:
         print("=" * 50)
         print("Запуск TrainsFormer AI...")
@@ -0,0 +1,71 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from TrainsFormerAI import ChatJournal
+
+
+class ChatJournalReplayTest(unittest.TestCase):
+    def setUp(self):
+        self.store_dir = tempfile.mkdtemp()
+        self.journal = ChatJournal(self.store_dir)
+    
+    def tearDown(self):
+        shutil.rmtree(self.store_dir, ignore_errors=True)
+    
+    def test_truncated_last_line_is_skipped(self):
+        self.journal.append_message(1, {'role': 'user', 'content': 'первое'})
+        self.journal.append_message(1, {'role': 'assistant', 'content': 'второе'})
+        # Аварийное завершение посреди записи оставляет недописанную строку
+        with open(self.journal.journal_path(1), 'a', encoding='utf-8') as f:
+            f.write('{"at": "2024-01-01T00:00:00", "message": {"role": "us')
+        
+        messages, records, _ = self.journal.replay(1)
+        
+        self.assertEqual([message['content'] for message in messages], ['первое', 'второе'])
+        self.assertEqual(records, 2)
+    
+    def test_load_replays_journal_changed_after_index(self):
+        chat = {'id': 1, 'name': 'Чат', 'messages': [{'role': 'user', 'content': 'раз'}]}
+        self.journal.write_chat(chat)
+        self.journal.save_index([chat], {})
+        self.journal.append_message(1, {'role': 'user', 'content': 'два'})
+        with open(self.journal.journal_path(1), 'a', encoding='utf-8') as f:
+            f.write('{"at": "2024-01-01T00:00:00", "mess')
+        
+        chats, _ = ChatJournal(self.store_dir).load()
+        
+        self.assertEqual(chats[0]['message_count'], 2)
+    
+    def test_compaction_keeps_only_messages_after_clear(self):
+        self.journal.append_message(1, {'role': 'user', 'content': 'старое'})
+        self.journal.clear_chat(1)
+        self.journal.append_message(1, {'role': 'user', 'content': 'новое'})
+        # Очистка уже запустила фоновое сжатие; повторное сжатие после него ничего не меняет
+        while self.journal.compacting:
+            time.sleep(0.01)
+        self.journal.compact(1)
+        
+        messages, records, _ = self.journal.replay(1)
+        
+        self.assertEqual([message['content'] for message in messages], ['новое'])
+        self.assertEqual(records, 1)
+    
+    def test_index_stores_journal_sizes(self):
+        chat = {'id': 7, 'name': 'Чат', 'messages': [{'role': 'user', 'content': 'привет'}]}
+        self.journal.write_chat(chat)
+        self.journal.save_index([chat], {'selected': 7})
+        
+        with open(os.path.join(self.store_dir, "index.json"), 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        
+        self.assertEqual(data['journals']['7'], [self.journal.journal_size(7), 1, 1])
+        self.assertNotIn('messages', data['chats'][0])
+        self.assertEqual(data['chat_data'], {'selected': 7})
+
+
+if __name__ == '__main__':
+    unittest.main()
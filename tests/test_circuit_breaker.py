@@ -0,0 +1,144 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from TrainsFormerAI import (CachedTranslator, CircuitBreaker, TranslationResult, TranslationUnavailable,
+                            TranslatorBackend)
+
+
+def fail():
+    raise ConnectionError("сеть недоступна")
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    def setUp(self):
+        self.breaker = CircuitBreaker(timeout=1.0, slow_after=0.5, max_failures=2, cooldown=0.2,
+                                      load_timeout=1.0)
+        # Первый вызов загружает переводчик и не учитывается
+        self.assertEqual(self.breaker.call(lambda: 'загружен'), 'загружен')
+    
+    def state(self):
+        return self.breaker.get_state()['state']
+    
+    def open_circuit(self):
+        for _ in range(self.breaker.max_failures):
+            with self.assertRaises(ConnectionError):
+                self.breaker.call(fail)
+    
+    def test_closed_open_half_open_closed(self):
+        self.assertEqual(self.state(), 'closed')
+        
+        self.open_circuit()
+        self.assertEqual(self.state(), 'open')
+        with self.assertRaises(TranslationUnavailable):
+            self.breaker.call(lambda: 'не вызывается')
+        
+        time.sleep(self.breaker.cooldown + 0.05)
+        self.assertEqual(self.state(), 'half_open')
+        
+        self.assertEqual(self.breaker.call(lambda: 'ok'), 'ok')
+        self.assertEqual(self.state(), 'closed')
+        self.assertEqual(self.breaker.get_state()['failures'], 0)
+    
+    def test_failed_trial_reopens(self):
+        self.open_circuit()
+        time.sleep(self.breaker.cooldown + 0.05)
+        
+        with self.assertRaises(ConnectionError):
+            self.breaker.call(fail)
+        
+        self.assertEqual(self.state(), 'open')
+    
+    def test_half_open_admits_single_trial(self):
+        self.open_circuit()
+        time.sleep(self.breaker.cooldown + 0.05)
+        release = threading.Event()
+        trial = threading.Thread(target=self.breaker.call, args=(release.wait,))
+        trial.start()
+        time.sleep(0.05)
+        
+        with self.assertRaises(TranslationUnavailable):
+            self.breaker.call(lambda: 'второй пробный вызов')
+        
+        release.set()
+        trial.join()
+        self.assertEqual(self.state(), 'closed')
+    
+    def test_timeout_counts_as_failure(self):
+        release = threading.Event()
+        with self.assertRaises(TranslationUnavailable):
+            self.breaker.call(release.wait, 5)
+        release.set()
+        
+        self.assertEqual(self.breaker.get_state()['failures'], 1)
+    
+    def test_busy_workers_are_reported(self):
+        # Зависших вызовов меньше, чем нужно для размыкания цепи
+        self.breaker.max_failures = self.breaker.max_workers + 1
+        self.breaker.timeout = 0.1
+        release = threading.Event()
+        for _ in range(self.breaker.max_workers):
+            with self.assertRaises(TranslationUnavailable):
+                self.breaker.call(release.wait, 5)
+        
+        self.assertEqual(self.state(), 'busy')
+        with self.assertRaises(TranslationUnavailable):
+            self.breaker.call(lambda: 'отклонён')
+        
+        release.set()
+        self.breaker.executor.shutdown(wait=True)
+        self.assertEqual(self.state(), 'closed')
+
+
+class FlakyBackend(TranslatorBackend):
+    name = "flaky"
+    
+    def __init__(self):
+        self.online = True
+        self.calls = 0
+    
+    def translate(self, text, dest='en', src='auto'):
+        self.calls += 1
+        if not self.online:
+            raise ConnectionError("сеть недоступна")
+        return TranslationResult(f"[{dest}] {text}", src, dest)
+
+
+class CachedTranslatorBreakerTest(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.backend = FlakyBackend()
+        self.breaker = CircuitBreaker(timeout=1.0, max_failures=1, cooldown=60.0)
+        self.translator = CachedTranslator(self.backend, os.path.join(self.cache_dir, "cache.sqlite3"),
+                                           breaker=self.breaker)
+    
+    def tearDown(self):
+        self.translator.connection.close()
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+    
+    def test_cache_hits_bypass_open_circuit(self):
+        self.translator.translate("привет")
+        self.backend.online = False
+        with self.assertRaises(TranslationUnavailable):
+            self.translator.translate("пока")
+        self.assertEqual(self.breaker.get_state()['state'], 'open')
+        
+        self.assertEqual(self.translator.translate("привет").text, "[en] привет")
+        self.assertEqual(self.backend.calls, 2)
+    
+    def test_failure_returns_cached_part_of_batch(self):
+        self.translator.translate("привет")
+        self.backend.online = False
+        
+        with self.assertRaises(TranslationUnavailable) as caught:
+            self.translator.translate_batch(["привет", "пока"])
+        
+        self.assertEqual(caught.exception.partial[0].text, "[en] привет")
+        self.assertIsNone(caught.exception.partial[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import unittest
+
+from TrainsFormerAI import ModelPool
+
+MB = 1024 * 1024
+
+
+class FakeTensor:
+    def __init__(self, size_mb):
+        self.size_mb = size_mb
+    
+    def numel(self):
+        return int(self.size_mb * MB)
+    
+    def element_size(self):
+        return 1
+
+
+class FakeModel:
+    """Модель без весов: ModelPool смотрит только на размер параметров"""
+    def __init__(self, size_mb):
+        self.weights = [FakeTensor(size_mb)]
+    
+    def parameters(self):
+        return self.weights
+    
+    def buffers(self):
+        return []
+
+
+def loader_for(sizes):
+    return lambda name: (None, FakeModel(sizes[name]), 'cpu')
+
+
+class ModelPoolEvictionTest(unittest.TestCase):
+    def setUp(self):
+        self.pool = ModelPool(budget_mb=250)
+        self.loader = loader_for({'a': 100, 'b': 100, 'c': 100})
+    
+    def test_least_recently_used_model_is_evicted(self):
+        self.pool.load('a', self.loader)
+        self.pool.load('b', self.loader)
+        self.pool.get('a')
+        self.pool.load('c', self.loader)
+        
+        self.assertEqual(list(self.pool.entries), ['a', 'c'])
+        self.assertLessEqual(self.pool.total_mb(), self.pool.budget_mb)
+    
+    def test_pinned_model_is_kept(self):
+        self.pool.load('a', self.loader)
+        self.pool.pin('a')
+        self.pool.load('b', self.loader)
+        self.pool.load('c', self.loader)
+        
+        self.assertEqual(list(self.pool.entries), ['a', 'c'])
+    
+    def test_smaller_budget_evicts_immediately(self):
+        self.pool.load('a', self.loader)
+        self.pool.load('b', self.loader)
+        self.pool.set_budget(150)
+        
+        self.assertEqual(list(self.pool.entries), ['b'])
+
+
+if __name__ == '__main__':
+    unittest.main()
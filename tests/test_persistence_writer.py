@@ -0,0 +1,61 @@
+import threading
+import time
+import unittest
+
+from TrainsFormerAI import PersistenceWriter
+
+
+class PersistenceWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.writes = []
+        self.written = threading.Event()
+        self.writer = PersistenceWriter(interval=60.0)
+        self.addCleanup(self.writer.close)
+        self.writer.register('config', self.save)
+    
+    def save(self):
+        self.writes.append('config')
+        self.written.set()
+    
+    def test_marks_within_interval_are_coalesced(self):
+        self.writer.mark_dirty('config')
+        self.assertTrue(self.written.wait(5))
+        
+        for _ in range(10):
+            self.writer.mark_dirty('config')
+        time.sleep(0.1)
+        self.assertEqual(self.writes, ['config'])
+        
+        self.writer.flush()
+        self.assertEqual(self.writes, ['config', 'config'])
+    
+    def test_flush_without_changes_writes_nothing(self):
+        self.writer.flush()
+        
+        self.assertEqual(self.writes, [])
+    
+    def test_close_writes_pending_changes_and_stops_thread(self):
+        self.writer.mark_dirty('config')
+        self.assertTrue(self.written.wait(5))
+        self.writer.mark_dirty('config')
+        
+        self.writer.close()
+        self.writer.thread.join(5)
+        
+        self.assertEqual(self.writes, ['config', 'config'])
+        self.assertFalse(self.writer.thread.is_alive())
+    
+    def test_failing_target_does_not_block_others(self):
+        self.writer.register('broken', lambda: 1 / 0)
+        self.writer.mark_dirty('config')
+        self.assertTrue(self.written.wait(5))
+        self.writer.mark_dirty('broken')
+        self.writer.mark_dirty('config')
+        
+        self.writer.flush()
+        
+        self.assertEqual(self.writes, ['config', 'config'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+import unittest
+
+from TrainsFormerAI import TRANSFORMERS_AVAILABLE, PrefixCache
+
+if TRANSFORMERS_AVAILABLE:
+    import torch
+
+MB = 1024 * 1024
+
+
+@unittest.skipUnless(TRANSFORMERS_AVAILABLE, "нужен torch")
+class PrefixCacheEvictionTest(unittest.TestCase):
+    TOKENS = 4
+    
+    def make_kv(self):
+        # Один слой, ключи и значения по 0.5 МБ
+        shape = (1, 1, self.TOKENS, MB // (8 * self.TOKENS))
+        return ((torch.zeros(shape), torch.zeros(shape)),)
+    
+    def setUp(self):
+        self.cache = PrefixCache(budget_mb=2.5)
+    
+    def test_least_recently_used_prefix_is_evicted(self):
+        self.cache.insert('m', [1, 2, 3, 4], self.make_kv())
+        self.cache.insert('m', [5, 6, 7, 8], self.make_kv())
+        self.cache.lookup('m', [1, 2, 3, 4, 9])
+        self.cache.insert('m', [10, 11, 12, 13], self.make_kv())
+        
+        self.assertEqual(self.cache.lookup('m', [1, 2, 3, 4, 9])[1], 4)
+        self.assertEqual(self.cache.lookup('m', [5, 6, 7, 8, 9])[1], 0)
+        self.assertEqual(self.cache.lookup('m', [10, 11, 12, 13, 9])[1], 4)
+        self.assertLessEqual(self.cache.total_mb, self.cache.budget_mb)
+    
+    def test_lookup_reuses_shorter_prefix(self):
+        self.cache.insert('m', [1, 2, 3, 4], self.make_kv())
+        
+        kv, length = self.cache.lookup('m', [1, 2, 7])
+        
+        self.assertEqual(length, 2)
+        self.assertEqual(kv[0][0].shape[2], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
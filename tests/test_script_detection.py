@@ -0,0 +1,77 @@
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import TrainsFormerAI
+from TrainsFormerAI import (InferenceEngine, StubTranslatorBackend, TranslationResult, detect_script,
+                            needs_translation)
+
+
+class DetectScriptTest(unittest.TestCase):
+    def test_cyrillic_and_latin(self):
+        self.assertEqual(detect_script("Привет, мир"), 'cyrillic')
+        self.assertEqual(detect_script("Hello, world"), 'latin')
+    
+    def test_majority_wins_in_mixed_text(self):
+        self.assertEqual(detect_script("Модель GPT-2 отвечает"), 'cyrillic')
+        self.assertEqual(detect_script("Run pip install на Windows"), 'latin')
+    
+    def test_text_without_letters(self):
+        self.assertIsNone(detect_script("2 + 2 = 4 !"))
+        self.assertIsNone(detect_script(""))
+
+
+class NeedsTranslationTest(unittest.TestCase):
+    def test_same_script_is_skipped(self):
+        self.assertFalse(needs_translation("Привет", 'ru'))
+        self.assertFalse(needs_translation("Hello", 'en'))
+    
+    def test_other_script_is_translated(self):
+        self.assertTrue(needs_translation("Hello", 'ru'))
+        self.assertTrue(needs_translation("Привет", 'en'))
+    
+    def test_empty_and_letterless_text_is_skipped(self):
+        self.assertFalse(needs_translation("", 'en'))
+        self.assertFalse(needs_translation("   ", 'ru'))
+        self.assertFalse(needs_translation("42", 'en'))
+    
+    def test_other_languages_are_always_translated(self):
+        self.assertTrue(needs_translation("Hello", 'de'))
+
+
+class CountingStub(StubTranslatorBackend):
+    def __init__(self):
+        self.batches = []
+    
+    def translate_batch(self, texts, dest='en', src='auto'):
+        self.batches.append(list(texts))
+        return [TranslationResult(f"[{dest}] {text}", src, dest) for text in texts]
+
+
+class TranslateSegmentsTest(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        patcher = mock.patch.multiple(TrainsFormerAI, translator=None, TRANSLATOR_AVAILABLE=False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.engine = InferenceEngine(self.data_dir, {'translator_backend': 'stub'})
+        self.addCleanup(self.engine.close)
+        self.stub = TrainsFormerAI.translator = CountingStub()
+    
+    def tearDown(self):
+        shutil.rmtree(self.data_dir, ignore_errors=True)
+    
+    def test_only_other_script_is_sent_in_one_batch(self):
+        translated = self.engine.translate_segments(["Привет", "Hello", "Как дела?", "Привет", "123"], 'en')
+        
+        self.assertEqual(self.stub.batches, [["Привет", "Как дела?"]])
+        self.assertEqual(translated, {"Привет": "[en] Привет", "Как дела?": "[en] Как дела?"})
+    
+    def test_nothing_to_translate_skips_translator(self):
+        self.assertEqual(self.engine.translate_segments(["Hello", "42"], 'en'), {})
+        self.assertEqual(self.stub.batches, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import threading
+import unittest
+
+from TrainsFormerAI import SentenceTranslationPipeline
+
+
+class SentenceTranslationPipelineTest(unittest.TestCase):
+    def setUp(self):
+        self.emitted = []
+    
+    def test_sentences_are_emitted_in_order(self):
+        first_started = threading.Event()
+        release_first = threading.Event()
+        
+        def translate(sentence):
+            if sentence.startswith("First"):
+                first_started.set()
+                release_first.wait(5)
+            return sentence.upper()
+        
+        pipeline = SentenceTranslationPipeline(translate, self.emitted.append)
+        pipeline.feed("First sentence. ")
+        first_started.wait(5)
+        pipeline.feed("Second one! Third?\n")
+        # Второе и третье предложения переведены раньше первого, но ждут его
+        self.assertEqual(self.emitted, [])
+        
+        release_first.set()
+        answer = pipeline.finish()
+        
+        self.assertEqual(self.emitted, ["FIRST SENTENCE. ", "SECOND ONE! ", "THIRD?\n"])
+        self.assertEqual(answer, "FIRST SENTENCE. SECOND ONE! THIRD?")
+        self.assertFalse(pipeline.failed)
+    
+    def test_chunks_are_joined_into_sentences(self):
+        pipeline = SentenceTranslationPipeline(lambda sentence: f"<{sentence}>", self.emitted.append)
+        for chunk in ["Hel", "lo wor", "ld. How", " are", " you"]:
+            pipeline.feed(chunk)
+        
+        self.assertEqual(pipeline.finish(), "<Hello world.> <How are you>")
+    
+    def test_text_after_stop_string_is_dropped(self):
+        pipeline = SentenceTranslationPipeline(lambda sentence: sentence, self.emitted.append,
+                                               stop_strings=["Question:"])
+        pipeline.feed("Paris is the capital. Quest")
+        pipeline.feed("ion: what else? More text.")
+        
+        self.assertEqual(pipeline.finish(), "Paris is the capital.")
+    
+    def test_failed_sentence_falls_back_to_source(self):
+        def translate(sentence):
+            if "bad" in sentence:
+                raise ConnectionError("сеть недоступна")
+            return sentence.upper()
+        
+        pipeline = SentenceTranslationPipeline(translate, self.emitted.append)
+        pipeline.feed("Good start. A bad one. Good end.")
+        
+        self.assertEqual(pipeline.finish(), "GOOD START. A bad one. GOOD END.")
+        self.assertTrue(pipeline.failed)
+
+
+if __name__ == '__main__':
+    unittest.main()
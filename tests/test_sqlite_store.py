@@ -0,0 +1,102 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from TrainsFormerAI import open_chat_store
+
+
+def make_chat(chat_id, name, *contents):
+    return {'id': chat_id, 'name': name, 'created_at': '2024-01-01T00:00:00',
+            'messages': [{'role': 'user', 'content': content} for content in contents]}
+
+
+class SQLiteChatStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        shutil.rmtree(self.data_dir, ignore_errors=True)
+    
+    def open_store(self):
+        store = open_chat_store(self.data_dir, "sqlite")
+        self.addCleanup(store.close)
+        return store
+    
+    def test_migrates_legacy_chats_file(self):
+        legacy = {'chats': [make_chat(1, 'Первый', 'раз', 'два'), make_chat(2, 'Второй')],
+                  'chat_data': {'selected': 1}}
+        with open(os.path.join(self.data_dir, "chats_data.json"), 'w', encoding='utf-8') as f:
+            json.dump(legacy, f, ensure_ascii=False)
+        
+        chats, chat_data = self.open_store().load()
+        
+        self.assertEqual([(chat['id'], chat['message_count']) for chat in chats], [(1, 2), (2, 0)])
+        self.assertNotIn('messages', chats[0])
+        self.assertEqual(chat_data, {'selected': 1})
+    
+    def test_migrates_journals(self):
+        journal = open_chat_store(self.data_dir, "journal")
+        chat = make_chat(3, 'Из журнала', 'привет')
+        journal.write_chat(chat)
+        journal.save_index([chat], {})
+        
+        store = self.open_store()
+        store.load()
+        
+        self.assertEqual([message['content'] for message in store.get_messages(3)], ['привет'])
+    
+    def test_migration_runs_once(self):
+        store = self.open_store()
+        store.load()
+        store.write_chat(make_chat(1, 'Чат', 'раз'))
+        store.close()
+        with open(os.path.join(self.data_dir, "chats_data.json"), 'w', encoding='utf-8') as f:
+            json.dump({'chats': [make_chat(9, 'Поздний')]}, f)
+        
+        chats, _ = self.open_store().load()
+        
+        self.assertEqual([chat['id'] for chat in chats], [1])
+    
+    def test_pending_messages_are_visible_before_flush(self):
+        store = self.open_store()
+        store.load()
+        store.write_chat(make_chat(1, 'Чат'))
+        store.append_message(1, {'role': 'user', 'content': 'первое'})
+        store.append_message(1, {'role': 'assistant', 'content': 'второе'})
+        
+        self.assertEqual([message['content'] for message in store.get_messages(1)], ['первое', 'второе'])
+    
+    def test_search_is_case_insensitive_for_cyrillic(self):
+        store = self.open_store()
+        store.load()
+        store.write_chat(make_chat(1, 'Рецепты борща'))
+        store.write_chat(make_chat(2, 'Python notes'))
+        store.write_chat(make_chat(3, 'БОРЩ и пельмени'))
+        
+        self.assertEqual(store.search_chats('борщ'), [1, 3])
+        self.assertEqual(store.search_chats('PYTHON'), [2])
+        self.assertEqual(store.search_chats('нет такого'), [])
+    
+    def test_statistics(self):
+        store = self.open_store()
+        store.load()
+        store.write_chat(make_chat(1, 'Чат', 'один два', 'три'))
+        store.append_message(1, {'role': 'user', 'content': 'четыре пять шесть'})
+        
+        self.assertEqual(store.get_statistics(), {'messages': 3, 'chars': 28, 'words': 6})
+    
+    def test_clear_chat_removes_messages_only(self):
+        store = self.open_store()
+        store.load()
+        store.write_chat(make_chat(1, 'Чат', 'раз', 'два'))
+        store.clear_chat(1)
+        
+        chats, _ = store.load()
+        
+        self.assertEqual([(chat['id'], chat['message_count']) for chat in chats], [(1, 0)])
+
+
+if __name__ == '__main__':
+    unittest.main()
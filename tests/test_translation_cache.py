@@ -0,0 +1,74 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from TrainsFormerAI import CachedTranslator, TranslationResult, TranslatorBackend
+
+
+class CountingBackend(TranslatorBackend):
+    name = "counting"
+    
+    def __init__(self):
+        self.requested = []
+    
+    def translate(self, text, dest='en', src='auto'):
+        self.requested.append(text)
+        return TranslationResult(f"[{dest}] {text}", 'ru', dest)
+
+
+class CachedTranslatorTest(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.cache_dir, "translations.sqlite3")
+        self.backend = CountingBackend()
+        self.translator = CachedTranslator(self.backend, self.db_path, max_entries=2)
+    
+    def tearDown(self):
+        self.translator.connection.close()
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+    
+    def test_repeated_text_is_served_from_cache(self):
+        first = self.translator.translate("привет")
+        second = self.translator.translate("привет")
+        
+        self.assertEqual(second.text, first.text)
+        self.assertEqual(second.src, 'ru')
+        self.assertEqual(self.backend.requested, ["привет"])
+        self.assertEqual(self.translator.get_stats(), {'entries': 1, 'hits': 1, 'misses': 1})
+    
+    def test_batch_requests_only_missing_texts(self):
+        self.translator.translate("раз")
+        
+        results = self.translator.translate_batch(["раз", "", "два"])
+        
+        self.assertEqual([result.text for result in results], ["[en] раз", "", "[en] два"])
+        self.assertEqual(self.backend.requested, ["раз", "два"])
+    
+    def test_least_recently_used_translation_is_evicted(self):
+        for text in ["раз", "два", "раз", "три", "раз", "два"]:
+            self.translator.translate(text)
+            # Порядок использования задаётся временем, а часы Windows грубые
+            time.sleep(0.02)
+        
+        self.assertEqual(self.backend.requested, ["раз", "два", "три", "два"])
+    
+    def test_cache_survives_restart(self):
+        self.translator.translate("привет")
+        self.translator.connection.close()
+        
+        self.translator = CachedTranslator(self.backend, self.db_path)
+        self.translator.translate("привет")
+        
+        self.assertEqual(self.backend.requested, ["привет"])
+    
+    def test_direction_is_part_of_the_key(self):
+        self.translator.translate("hello", dest='ru')
+        self.translator.translate("hello", dest='de')
+        
+        self.assertEqual(self.backend.requested, ["hello", "hello"])
+
+
+if __name__ == '__main__':
+    unittest.main()